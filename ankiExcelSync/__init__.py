@@ -1,6 +1,15 @@
-from .menu import modify_menu
-from .auto import onlaunch, setclose
+try:
+    from aqt import mw
+except ImportError:  # excel.py and parallel.py do not need Anki
+    mw = None
 
-onlaunch()
-setclose()
-modify_menu()
+# parse worker processes import this package without a main window
+if mw is not None:
+    from .menu import modify_menu
+    from .auto import onlaunch, setclose
+    from .watch import setwatch
+
+    onlaunch()
+    setclose()
+    setwatch()
+    modify_menu()
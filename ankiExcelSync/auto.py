@@ -9,7 +9,8 @@ from .menu import confirm_a2e_sync
 def sync_launch(self, onsuccess=None):
     self.loadCollection()
     try:
-        ExcelSync()._e2a_sync()
+        # the collection is closed right after, so the sync cannot run in the background
+        ExcelSync(background=False)._e2a_sync()
     except Exception as e:
         showText(str(e))
 
@@ -23,7 +24,7 @@ def sync_launch(self, onsuccess=None):
 
 
 def sync_close():
-    confirm_a2e_sync()
+    confirm_a2e_sync(background=False)
 
 
 def onlaunch():
@@ -0,0 +1,140 @@
+"""
+Runs syncs without Anki's main window, e.g. on build servers.
+
+    python -m ankiExcelSync e2a --yes path/to/collection.anki2 [...]
+
+Run it from the add-on folder, with the anki and aqt packages installed.
+One json line with the timings, counts and log of the sync is printed
+for each collection.
+"""
+import os
+import json
+import argparse
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Progress:
+    def __init__(self):
+        self._busy = False
+
+    def start(self, *args, **kwargs):
+        self._busy = True
+
+    def update(self, *args, **kwargs):
+        pass
+
+    def finish(self):
+        self._busy = False
+
+    def busy(self):
+        return self._busy
+
+
+class AddonManager:
+    def __init__(self, config):
+        self.config = config
+
+    def getConfig(self, module):
+        return self.config
+
+
+class HeadlessMain:
+    """
+    Takes the place of aqt.mw, with the parts of it that syncs use.
+    col is set to each collection in turn.
+    """
+
+    def __init__(self, config):
+        self.col = None
+        self.progress = Progress()
+        self.addonManager = AddonManager(config)
+
+    def reset(self):
+        pass
+
+
+def load_config(path=None):
+    """
+    Returns the add-on config: defaults from config.json,
+    then what was saved in Anki, then the json file at path.
+    """
+    with open(os.path.join(ADDON_DIR, "config.json"), encoding="utf-8") as f:
+        config = json.load(f)
+    try:
+        with open(os.path.join(ADDON_DIR, "meta.json"), encoding="utf-8") as f:
+            config.update(json.load(f).get("config", {}))
+    except (OSError, ValueError):
+        pass
+    if path:
+        with open(path, encoding="utf-8") as f:
+            config.update(json.load(f))
+    return config
+
+
+def open_collection(path):
+    try:
+        from anki.collection import Collection
+    except ImportError:  # before 2.1.28
+        from anki import Collection
+    return Collection(path)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m ankiExcelSync")
+    parser.add_argument("direction", choices=("e2a", "a2e"))
+    parser.add_argument("collections", nargs="+", metavar="collection")
+    policy = parser.add_mutually_exclusive_group(required=True)
+    policy.add_argument(
+        "--yes", action="store_true", help="answer every confirmation with yes"
+    )
+    policy.add_argument(
+        "--dry-run", action="store_true", help="only report what would change"
+    )
+    parser.add_argument("--directory", help="overrides _directory of the config")
+    parser.add_argument("--config", help="json file overriding the add-on config")
+    parser.add_argument(
+        "--full-rescan", action="store_true", help="read every excel file"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Returns 0 if every sync succeeded, 1 otherwise"""
+    args = parse_args(argv)
+    config = load_config(args.config)
+    if args.directory:
+        config["_directory"] = args.directory
+
+    import aqt
+
+    # add-on modules keep the mw they were imported with
+    if not isinstance(aqt.mw, HeadlessMain):
+        aqt.mw = HeadlessMain(config)
+    mw = aqt.mw
+    mw.addonManager.config = config
+    # menu is imported first, as in Anki, since it imports sync
+    from . import menu  # noqa: F401
+    from .headless import HeadlessSync
+
+    failed = False
+    for path in args.collections:
+        sync = HeadlessSync(full_rescan=args.full_rescan, dry_run=args.dry_run)
+        try:
+            mw.col = open_collection(path)
+            try:
+                if args.direction == "e2a":
+                    sync._e2a_sync()
+                else:
+                    sync._a2e_sync()
+            finally:
+                mw.col.close()
+        except Exception as e:
+            sync.errors.append("%s: %s" % (type(e).__name__, e))
+        finally:
+            mw.col = None
+        result = sync.result()
+        result["collection"] = path
+        failed = failed or bool(result["errors"])
+        print(json.dumps(result, ensure_ascii=False), flush=True)
+    return 1 if failed else 0
@@ -3,6 +3,10 @@ import traceback
 import html
 
 
+class SyncCancelledError(Exception):
+    """The user cancelled the sync. Not an AnkiExcelError, as it is not shown."""
+
+
 class AnkiExcelError(Exception):
     def output_message(self):
         msg = "<br>".join(
@@ -34,11 +38,16 @@ class InvalidModelDesignatorError(AnkiExcelError):
         Model designator on notes row
          cannot be found on the headers row
         """
+        self.args_ = (filepath, row, value)
         self.filepath = html.escape(filepath)
         self.row = row
         self.value = html.escape(value)
         super().__init__(str(self))
 
+    def __reduce__(self):
+        # raised in parse worker processes
+        return (self.__class__, self.args_)
+
     def __str__(self):
         msg = "<br>".join(
             (
@@ -62,12 +71,17 @@ class CannotWriteValueError(AnkiExcelError):
     """
 
     def __init__(self, filepath, row, col, value):
+        self.args_ = (filepath, row, col, value)
         self.filepath = html.escape(filepath)
         self.row = row
         self.col = col
-        self.value = html.escape(value)
+        self.value = html.escape(str(value))
         super().__init__(str(self))
 
+    def __reduce__(self):
+        # raised in write worker processes
+        return (self.__class__, self.args_)
+
     def __str__(self):
         msg = "<br>".join(
             (
@@ -164,7 +178,7 @@ class DeckNameDoesNotExistError(AnkiExcelError):
 class MultipleSuperTagError(AnkiExcelError):
     def __init__(self, note):
         self.id = note.id
-        self.tags = html.escape(self.tags)
+        self.tags = html.escape(" ".join(note.tags))
         super().__init__(str(self))
 
     def __str__(self):
@@ -175,6 +189,7 @@ class MultipleSuperTagError(AnkiExcelError):
                 "tags: {}".format(self.tags),
             )
         )
+        return msg
 
 
 class DidNotConfigureDirectoryError(AnkiExcelError):
@@ -1,7 +1,72 @@
 import os
+import csv
+import time
 
 from .errors import *
+from .scanner import TEXT_EXTS
 from openpyxl import load_workbook, Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
+
+
+def cell_value(row, col):
+    """Value of cell at 0 based col, or None if row is shorter"""
+    if col < len(row):
+        return row[col]
+    return None
+
+
+def is_text_file(path):
+    return path.lower().endswith(TEXT_EXTS)
+
+
+def open_file(path, ext=None, read_only=False):
+    """
+    Returns an ExcelFile, or a TextFile for .csv and .tsv files.
+    ext[str]: extension of the file, if path is a temporary file
+    """
+    ext = (ext or os.path.splitext(path)[1]).lower()
+    if ext in TEXT_EXTS:
+        return TextFile(path, ext)
+    if read_only:
+        return ExcelFileReadOnly(path)
+    return ExcelFile(path)
+
+
+def parse_file(path):
+    """
+    Reads note rows of the excel file at path.
+    Returns (rows, {"load": seconds, "parse": seconds}).
+    Has no Anki dependency, so it can run in a worker process.
+    """
+    start = time.perf_counter()
+    ef = open_file(path, read_only=True)
+    ef.load_file()
+    loaded = time.perf_counter()
+    try:
+        rows = ef.read_file()
+    finally:
+        ef.close()
+    return (rows, {"load": loaded - start, "parse": time.perf_counter() - loaded})
+
+
+def write_file(path, rows, col_width, ext=None):
+    """
+    Writes rows into a new excel file at path.
+    ext[str]: extension of the file, if path is a temporary file
+    Returns {"write": seconds, "save": seconds}.
+    Has no Anki dependency, so it can run in a worker process.
+    """
+    start = time.perf_counter()
+    ef = open_file(path, ext)
+    ef.create_file()
+    try:
+        ef.write_rows(rows, col_width)
+        written = time.perf_counter()
+        ef.save()
+    finally:
+        ef.close()
+    return {"write": written - start, "save": time.perf_counter() - written}
 
 
 class ExcelFileReadOnly:
@@ -10,44 +75,46 @@ class ExcelFileReadOnly:
 
     def load_file(self):
         self.wb = load_workbook(filename=self.path, read_only=True, data_only=True)
-        ws = self.wb.worksheets[0]
-        self.ws = ws
-        self.wsv = ws.values
+        self.ws = self.wb.worksheets[0]
+        # the <dimension> of the sheet is often left stale by other writers,
+        # and read-only sheets would stop at it
+        self.ws.reset_dimensions()
+
+    def iter_rows(self):
+        """Yields rows of the sheet as tuples of cell values"""
+        return self.ws.iter_rows(values_only=True)
 
     def read_file(self):
-        ws = self.ws
-        wsv = self.wsv
         models = []
         models_fields = []
         models_desg = []
+        rows_data = []
         log = ""
 
-        # Get name of models in first row
-        for row in ws.iter_rows(min_row=1, max_row=1):
-            for cell in row:
-                if cell.value:
-                    model = str(cell.value).strip()
-                    if model:
-                        models.append(model)
-
-        # Get name of fields per model
-        for n in range(len(models)):
-            for row in ws.iter_rows(min_row=n + 2, max_row=n + 2):
+        # Rows are read in a single pass, as read-only worksheets
+        # parse the sheet from the start on every iter_rows call
+        for row_num, row in enumerate(self.iter_rows(), 1):
+            # Get name of models in first row
+            if row_num == 1:
+                for val in row:
+                    if val:
+                        model = str(val).strip()
+                        if model:
+                            models.append(model)
+                continue
+
+            # Get name of fields per model
+            if row_num < len(models) + 2:
                 model_fields = []
-                for cell in row[1:]:
-                    if cell.value and str(cell.value).strip():
-                        cell = str(cell.value).strip()
-                        model_fields.append(cell)
+                for val in row[1:]:
+                    if val and str(val).strip():
+                        model_fields.append(str(val).strip())
                 models_fields.append(model_fields)
-                models_desg.append(str(row[0].value).strip())
-        self.models_fields = models_fields
-        self.models = models
-        self.models_desg = models_desg
-        rows_data = []
+                models_desg.append(str(cell_value(row, 0)).strip())
+                continue
 
-        # Go through each note rows
-        for row in ws.iter_rows(min_row=2 + len(models)):
-            model_desg = row[0].value
+            # Go through each note rows
+            model_desg = cell_value(row, 0)
             if not model_desg:
                 log += ""
                 continue
@@ -57,24 +124,24 @@ class ExcelFileReadOnly:
             except Exception as e:
                 self.close()
                 raise InvalidModelDesignatorError(
-                    self.path, row[0].row, model_desg
+                    self.path, row_num, model_desg
                 ) from e
             model_name = models[model_index]
             model_fields = models_fields[model_index]
-            nid = row[len(model_fields) + 1].value
+            nid = cell_value(row, len(model_fields) + 1)
             if nid:
                 try:
                     nid = int(nid)
                 except ValueError:
                     log += (
                         "\n<b>Non-fatal</b>: non integer value '%s' in nid field, in %d row"
-                        % (str(nid), row[0].row)
+                        % (str(nid), row_num)
                     )
                     nid = None
             else:
                 nid = None
             row_data = {
-                "row": row[0].row,
+                "row": row_num,
                 "id": nid,
                 "model": model_name,
                 "fields": {},
@@ -83,11 +150,15 @@ class ExcelFileReadOnly:
             }  # row is 1 based
             # Get field values
             for i in range(0, len(model_fields)):
-                if row[i + 1].value:
-                    row_data["fields"][model_fields[i]] = str(row[i + 1].value)
+                val = cell_value(row, i + 1)
+                if val:
+                    row_data["fields"][model_fields[i]] = str(val)
                 else:
                     row_data["fields"][model_fields[i]] = None
             rows_data.append(row_data)
+        self.models_fields = models_fields
+        self.models = models
+        self.models_desg = models_desg
         # [{"row":int, "id":int, "fields":{"fieldName":str_val,}, "model": str_model_name, "log": str_log}]
         return rows_data
 
@@ -98,9 +169,7 @@ class ExcelFileReadOnly:
 class ExcelFile(ExcelFileReadOnly):
     def load_file(self):
         self.wb = load_workbook(filename=self.path)
-        ws = self.wb.worksheets[0]
-        self.ws = ws
-        self.wsv = ws.values
+        self.ws = self.wb.worksheets[0]
 
     def set_id(self, row, fields, id):
         self.write_cell(row, len(fields) + 2, id)
@@ -108,9 +177,9 @@ class ExcelFile(ExcelFileReadOnly):
         # cell.value = id
 
     def create_file(self):
-        self.wb = Workbook()
-        self.ws = self.wb.worksheets[0]
-        self.ws.title = "Anki Cards"
+        # rows are streamed to disk as they are written
+        self.wb = Workbook(write_only=True)
+        self.ws = self.wb.create_sheet("Anki Cards")
 
     def write_cell(self, row, col, val):
         try:
@@ -118,55 +187,122 @@ class ExcelFile(ExcelFileReadOnly):
         except Exception as e:
             raise CannotWriteValueError(self.path, row, col, val) from e
 
-    def write(self, notes, models, col_width):
-        ws = self.ws
-        first_line = []
-        headers = []
+    def rows(self, notes, models):
+        """
+        Yields rows of the spreadsheet as lists of cell values,
+        starting with the model names row and note-type-rows.
+        """
+        yield [model["name"] for model in models]
         for model in models:
-            first_line.append(model["name"])
-            hd = [model["id"]]
-            hd += model["flds"]
-            headers.append(hd)
-
-        # write headers
-        for n in range(len(first_line)):
-            self.write_cell(1, n + 1, first_line[n])
-        for n in range(len(headers)):
-            for m in range(len(headers[n])):
-                self.write_cell(n + 2, m + 1, headers[n][m])
-
-        # write notes
-        crow = len(headers) + 1  # 1 row before first row of note rows
+            yield [model["id"]] + model["flds"]
+
+        models_by_name = {model["name"]: model for model in models}
+        # model name: (designator, column of each note field, number of fields)
+        layouts = {}
         for note in notes:
-            crow += 1
             model = note.model()
-            val_row = [None] * len(model["flds"])
-            thismodel = None
-            for mdl in models:
-                if mdl["name"] == model["name"]:
-                    thismodel = mdl
-                    break
-            if not thismodel:
-                raise ModelNameDoesNotExistError(model["name"])
-
-            self.write_cell(crow, 1, str(thismodel["id"]))
-            for n in range(len(model["flds"])):
-                for m in range(len(thismodel["flds"])):
-                    if thismodel["flds"][m] == model["flds"][n]["name"]:
-                        val_row[m] = note.fields[n]
-                        break
-            for n in range(len(val_row)):
-                self.write_cell(crow, n + 2, str(val_row[n]))
-            self.write_cell(crow, len(model["flds"]) + 2, note.id)
+            layout = layouts.get(model["name"])
+            if layout is None:
+                thismodel = models_by_name.get(model["name"])
+                if not thismodel:
+                    raise ModelNameDoesNotExistError(self.path, model["name"])
+                cols = {}
+                for m, fldnm in enumerate(thismodel["flds"]):
+                    cols.setdefault(fldnm, m)
+                layout = (
+                    str(thismodel["id"]),
+                    [cols.get(fld["name"]) for fld in model["flds"]],
+                    len(model["flds"]),
+                )
+                layouts[model["name"]] = layout
 
+            desg, cols, fld_cnt = layout
+            val_row = [None] * fld_cnt
+            for n, m in enumerate(cols):
+                if m is not None:
+                    val_row[m] = note.fields[n]
+            row = [desg]
+            row += [str(val) for val in val_row]
+            row.append(note.id)
+            yield row
+
+    def write(self, notes, models, col_width):
+        self.write_rows(self.rows(notes, models), col_width)
+
+    def write_rows(self, rows, col_width):
+        ws = self.ws
+        # column widths need to be set before rows are written
         for x in range(len(col_width)):
-            cl = ws.cell(row=1, column=x + 1)
-            if cl:
-                col = cl.column_letter
-                ws.column_dimensions[col].width = col_width[x]
+            ws.column_dimensions[get_column_letter(x + 1)].width = col_width[x]
+
+        for r, row in enumerate(rows, 1):
+            try:
+                ws.append(row)
+            except Exception as e:
+                col, val = self.invalid_value(row)
+                raise CannotWriteValueError(self.path, r, col, val) from e
+
+    def invalid_value(self, row):
+        """Returns (1 based column, value) of first value that cannot be written"""
+        cell = WriteOnlyCell(self.ws)
+        for col, val in enumerate(row, 1):
+            try:
+                cell.value = val
+            except Exception:
+                return (col, val)
+        return (0, "")
 
     def save(self):
         dir = os.path.dirname(self.path)
         if not os.path.exists(dir):
             os.makedirs(dir)
         self.wb.save(filename=self.path)
+
+
+class TextFile(ExcelFile):
+    """
+    .csv or .tsv file, with the same rows as excel files.
+    It is read with the csv module, and saved by writing a temporary file
+    that then replaces the file.
+    """
+
+    def __init__(self, path, ext=".csv"):
+        super().__init__(path)
+        self.dialect = "excel-tab" if ext == ".tsv" else "excel"
+        self.values = None
+
+    def load_file(self):
+        with open(self.path, newline="", encoding="utf-8-sig") as f:
+            self.values = list(csv.reader(f, self.dialect))
+
+    def iter_rows(self):
+        return iter(self.values)
+
+    def close(self):
+        self.values = None
+
+    def write_cell(self, row, col, val):
+        values = self.values[row - 1]
+        if len(values) < col:
+            values.extend([""] * (col - len(values)))
+        values[col - 1] = val
+
+    def create_file(self):
+        self.values = []
+
+    def write_rows(self, rows, col_width):
+        # rows are written when the file is saved
+        self.values = rows
+
+    def save(self):
+        dir = os.path.dirname(self.path)
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+        tmp = self.path + ".aes-tmp"
+        try:
+            with open(tmp, "w", newline="", encoding="utf-8") as f:
+                csv.writer(f, self.dialect).writerows(self.values)
+            os.replace(tmp, self.path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
@@ -0,0 +1,41 @@
+import re
+import html
+
+from .sync import ExcelSync
+
+TAG_RE = re.compile(r"<[^>]+>")
+
+
+def plain_text(msg):
+    """Error messages are html, for showText"""
+    return html.unescape(TAG_RE.sub("", msg.replace("<br>", "\n")))
+
+
+class HeadlessSync(ExcelSync):
+    """
+    ExcelSync that shows no dialogs, for the command line runner.
+    Import it after cli.HeadlessMain was put in place of aqt.mw.
+
+    Every confirmation is answered with yes.
+    With dry_run, the sync stops before anything would be changed.
+    """
+
+    def __init__(self, full_rescan=False, dry_run=False):
+        super().__init__(full_rescan=full_rescan, dry_run=dry_run)
+        self.errors = []
+
+    def confirm(self, text):
+        return True
+
+    def show_log(self):
+        pass
+
+    def output_error(self, exception):
+        self.errors.append(plain_text(str(exception)))
+
+    def result(self):
+        record = self.stats.record() if self.stats else {}
+        record["dry_run"] = self.dry_run
+        record["errors"] = self.errors
+        record["log"] = [plain_text(line) for line in self.log]
+        return record
@@ -0,0 +1,152 @@
+import os
+import time
+import gzip
+import json
+
+from anki.utils import ids2str
+
+from .notes import LOOKUP_CHUNK
+
+JOURNAL_DIR = "excel_sync_journal"
+JOURNAL_VERSION = 1
+# number of journals kept, oldest ones are removed
+JOURNAL_KEEP = 5
+
+NOTE_COLS = "id, guid, mid, mod, usn, tags, flds, sfld, csum, flags, data"
+CARD_COLS = (
+    "id, nid, did, ord, mod, usn, type, queue, due, ivl, factor,"
+    " reps, lapses, left, odue, odid, flags, data"
+)
+
+
+def journal_dir(col):
+    return os.path.join(os.path.dirname(col.path), JOURNAL_DIR)
+
+
+def journals(col):
+    """Returns paths of journals that were not rolled back, oldest first"""
+    dirc = journal_dir(col)
+    if not os.path.isdir(dirc):
+        return []
+    names = sorted(n for n in os.listdir(dirc) if n.endswith(".jsonl.gz"))
+    return [os.path.join(dirc, n) for n in names]
+
+
+def select_rows(col, sql, ids):
+    """sql has a single %s, which is replaced with a chunk of ids"""
+    ids = list(ids)
+    rows = []
+    for i in range(0, len(ids), LOOKUP_CHUNK):
+        rows.extend(col.db.all(sql % ids2str(ids[i : i + LOOKUP_CHUNK])))
+    return [list(row) for row in rows]
+
+
+class SyncJournal:
+    """
+    Write-ahead record of what an Excel -> Anki sync changes.
+
+    Before notes are modified or deleted, their rows in the notes table
+    (and for deleted notes, the cards table) are written to the journal.
+    Ids of created notes are written after each batch is added.
+    rollback() uses the journal to put the collection back as it was.
+
+    The journal is a gzipped file of json lines, kept next to the collection.
+    """
+
+    def __init__(self, col):
+        self.col = col
+        dirc = journal_dir(col)
+        if not os.path.exists(dirc):
+            os.makedirs(dirc)
+        name = "%d.jsonl.gz" % int(time.time() * 1000)
+        self.path = os.path.join(dirc, name)
+        self.file = gzip.open(self.path, "wt", encoding="utf-8")
+        self.write({"version": JOURNAL_VERSION, "time": int(time.time())})
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False))
+        self.file.write("\n")
+        self.file.flush()
+
+    def record_modify(self, nids):
+        rows = select_rows(
+            self.col, "select %s from notes where id in %%s" % NOTE_COLS, nids
+        )
+        self.write({"notes": rows})
+
+    def record_delete(self, nids):
+        self.record_modify(nids)
+        rows = select_rows(
+            self.col, "select %s from cards where nid in %%s" % CARD_COLS, nids
+        )
+        self.write({"cards": rows})
+
+    def record_added(self, nids):
+        self.write({"added": list(nids)})
+
+    def close(self):
+        self.file.close()
+        self.prune()
+
+    def prune(self):
+        dirc = journal_dir(self.col)
+        names = sorted(os.listdir(dirc))
+        for name in names[:-JOURNAL_KEEP]:
+            os.remove(os.path.join(dirc, name))
+
+
+def rollback(col, path):
+    """
+    Puts notes touched by the sync in journal at path back as they were.
+    Created notes are removed, modified and deleted notes are restored.
+    Restored rows get a new mod time and usn, so they are synced to AnkiWeb.
+    """
+    notes = []
+    cards = []
+    added = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("version") != JOURNAL_VERSION:
+            raise ValueError("unknown journal version")
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break  # sync stopped while writing this line
+            notes.extend(record.get("notes", []))
+            cards.extend(record.get("cards", []))
+            added.extend(record.get("added", []))
+
+    if added:
+        col.remNotes(added)
+
+    mod = int(time.time())
+    usn = col.usn()
+    for row in notes:
+        row[3] = mod
+        row[4] = usn
+    for row in cards:
+        row[4] = mod
+        row[5] = usn
+    col.db.executemany(
+        "insert or replace into notes (%s) values (%s)"
+        % (NOTE_COLS, ",".join("?" * len(NOTE_COLS.split(",")))),
+        notes,
+    )
+    col.db.executemany(
+        "insert or replace into cards (%s) values (%s)"
+        % (CARD_COLS, ",".join("?" * len(CARD_COLS.split(",")))),
+        cards,
+    )
+    # restored notes and cards should not be deleted on the next AnkiWeb sync
+    ids = [row[0] for row in notes] + [row[0] for row in cards]
+    for i in range(0, len(ids), LOOKUP_CHUNK):
+        col.db.execute(
+            "delete from graves where oid in %s" % ids2str(ids[i : i + LOOKUP_CHUNK])
+        )
+    if hasattr(col.tags, "registerNotes"):
+        col.tags.registerNotes([row[0] for row in notes])
+    if hasattr(col, "setMod"):
+        col.setMod()
+    os.rename(path, path[: -len(".jsonl.gz")] + ".rolledback.gz")
+    return (len(added), len(notes))
@@ -1,6 +1,6 @@
-from PyQt5.QtWidgets import QAction
+from PyQt5.QtWidgets import QAction, QPushButton
 from aqt import mw
-from aqt.utils import askUserDialog
+from aqt.utils import askUserDialog, showText
 
 
 def confirm_win(text="", conf="Yes", canc="Cancel", default=0):
@@ -13,7 +13,21 @@ def confirm_win(text="", conf="Yes", canc="Cancel", default=0):
         return False
 
 
+def add_cancel_button(progress):
+    """
+    Adds a Cancel button to the progress window of mw.progress.
+    Clicking it is the same as closing the window, which sets wantCancel.
+    """
+    win = getattr(progress, "_win", None)
+    if win is None or not hasattr(win, "wantCancel") or win.layout() is None:
+        return
+    button = QPushButton("Cancel", win)
+    button.clicked.connect(lambda: setattr(win, "wantCancel", True))
+    win.layout().addWidget(button)
+
+
 from .sync import ExcelSync  # Prevent circular import
+from .journal import journals, rollback
 
 
 def create_action(name, handler):
@@ -22,7 +36,7 @@ def create_action(name, handler):
     return action
 
 
-def confirm_e2a_sync():
+def confirm_e2a_sync(full_rescan=False):
     txt = """
 <b> Excel -> Anki </b>
 The Anki Cards with selected tags will be replaced by data from Excel.
@@ -31,10 +45,14 @@ Anki cards will be overwritten.
 """
     conf = confirm_win(txt, "Create", "Cancel")
     if conf:
-        ExcelSync().e2a_sync()
+        ExcelSync(full_rescan=full_rescan).e2a_sync()
+
 
+def confirm_e2a_full_sync():
+    confirm_e2a_sync(full_rescan=True)
 
-def confirm_a2e_sync():
+
+def confirm_a2e_sync(background=True):
     txt = """
 <b>Anki -> Excel</b>
 Excel files will be created from existing Anki Cards with selected tags.
@@ -42,15 +60,43 @@ Excel files will be created from existing Anki Cards with selected tags.
     conf = confirm_win(txt, "Create", "Cancel")
 
     if conf:
-        ExcelSync().a2e_sync()
+        ExcelSync(background=background).a2e_sync()
         cnfg = mw.addonManager.getConfig(__name__)
         mw.addonManager.writeConfig(__name__, cnfg)
 
 
+def confirm_undo_e2a_sync():
+    paths = journals(mw.col)
+    if not paths:
+        showText("There is no Excel -> Anki sync to undo.", title="Excel Sync")
+        return
+    txt = """
+<b>Undo Excel -> Anki</b>
+Notes created by the last Excel -> Anki sync will be deleted,
+and notes it modified or deleted will be restored.
+
+Excel files are not changed.
+"""
+    conf = confirm_win(txt, "Undo", "Cancel")
+    if conf:
+        removed, restored = rollback(mw.col, paths[-1])
+        mw.reset()
+        showText(
+            "{} notes removed, {} notes restored".format(removed, restored),
+            title="Excel Sync",
+        )
+
+
 def modify_menu():
     label = "Anki -> Excel"
     action = create_action(label, confirm_a2e_sync)
     mw.form.menuTools.addAction(action)
     label = "Excel -> Anki"
-    action = create_action(label, confirm_e2a_sync)
+    action = create_action(label, lambda: confirm_e2a_sync())
+    mw.form.menuTools.addAction(action)
+    label = "Excel -> Anki (Full Rescan)"
+    action = create_action(label, confirm_e2a_full_sync)
+    mw.form.menuTools.addAction(action)
+    label = "Undo Last Excel -> Anki"
+    action = create_action(label, confirm_undo_e2a_sync)
     mw.form.menuTools.addAction(action)
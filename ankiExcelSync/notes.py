@@ -0,0 +1,40 @@
+from collections import namedtuple
+
+# number of note ids inlined into a single `id in (...)` query
+LOOKUP_CHUNK = 10000
+
+# What Excel -> Anki does with a note row, kept instead of the row itself.
+# file[int]: index of the file among the files read
+# fields[tuple]: (field name, cell value) of the row
+RowDecision = namedtuple("RowDecision", "nid file row model fields hash")
+
+
+class NoteRecord:
+    """
+    Read-only view of a row of the notes table.
+
+    Exposes the part of anki.notes.Note that same_note uses,
+    so existing notes can be compared without loading each one.
+    """
+
+    def __init__(self, nid, model, mod, fields, tags):
+        self.id = nid
+        self.mid = model["id"]
+        self.mod = mod
+        self.tags = tags
+        self._model = model
+        self._fmap = {}
+        for fld, val in zip(model["flds"], fields):
+            self._fmap[fld["name"]] = val
+
+    def model(self):
+        return self._model
+
+    def keys(self):
+        return self._fmap.keys()
+
+    def __getitem__(self, key):
+        return self._fmap[key]
+
+    def __contains__(self, key):
+        return key in self._fmap
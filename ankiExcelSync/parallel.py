@@ -0,0 +1,80 @@
+import os
+import sys
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from .excel import parse_file, write_file
+
+
+def pool_workers(workers, jobs):
+    """
+    Returns the number of worker processes to use, 0 meaning in this process.
+    Frozen Anki builds cannot start Python child processes, so they always get 0.
+    """
+    if getattr(sys, "frozen", False):
+        return 0
+    workers = min(workers, jobs)
+    if workers <= 1:
+        return 0
+    return workers
+
+
+def parse_files(paths, workers=0):
+    """
+    Yields (note rows, timings) of each file in paths, in the same order as paths.
+    With workers > 1, files are parsed in a pool of worker processes.
+    """
+    workers = pool_workers(workers, len(paths))
+    if not workers:
+        for path in paths:
+            yield parse_file(path)
+        return
+
+    # only a few files are parsed ahead,
+    # so rows of all files are not in memory together
+    pending = collections.deque()
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as executor:
+        for path in paths:
+            pending.append(executor.submit(parse_file, path))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_files(jobs, col_width, workers):
+    """
+    jobs[iterable]: (path, rows) of excel files to write
+    Yields (path, timings) of each file once it is written, in the same order as jobs.
+
+    Workers save each workbook to a temporary file, which is then moved to path
+    in this process. Only a few jobs are queued at once, so rows of all files
+    do not need to be in memory together.
+    """
+    pending = collections.deque()
+
+    def finish():
+        path, tmp, future = pending.popleft()
+        times = future.result()
+        os.replace(tmp, path)
+        return (path, times)
+
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as executor:
+            for path, rows in jobs:
+                tmp = path + ".aes-tmp"
+                ext = os.path.splitext(path)[1]
+                future = executor.submit(write_file, tmp, rows, col_width, ext)
+                pending.append((path, tmp, future))
+                if len(pending) >= workers * 2:
+                    yield finish()
+            while pending:
+                yield finish()
+    finally:
+        # sync stopped midway
+        for path, tmp, future in pending:
+            if os.path.exists(tmp):
+                os.remove(tmp)
@@ -0,0 +1,149 @@
+import os
+import re
+import fnmatch
+import unicodedata
+from collections import namedtuple
+
+from .errors import *
+
+EXCEL_EXTS = (".xlsx", ".xlsm", ".xls")
+# files with the same rows as excel files, as comma or tab separated values
+TEXT_EXTS = (".csv", ".tsv")
+# Excel lock files, and macOS metadata files on shared drives
+DEFAULT_IGNORE = ("~$*", "._*")
+# fail-safe against directory loops
+MAX_DEPTH = 200
+# tag.part2.xlsx is the second file of tag, see shard_paths
+SHARD_RE = re.compile(r"\.part\d+$")
+
+# rel is the path relative to the synced directory, mtime is in ns
+ScannedFile = namedtuple("ScannedFile", "src rel tag size mtime")
+
+
+def shard_base(stem):
+    """Returns path or file name stem without a .partN suffix"""
+    return SHARD_RE.sub("", stem)
+
+
+def shard_paths(base, ext, cnt, max_rows):
+    """
+    Returns paths of the files cnt notes of a tag are written to,
+    base + ext, or base.part1 + ext, base.part2 + ext ...
+    if there are more than max_rows notes.
+    """
+    if not max_rows or cnt <= max_rows:
+        return [base + ext]
+    shards = (cnt + max_rows - 1) // max_rows
+    return ["%s.part%d%s" % (base, n, ext) for n in range(1, shards + 1)]
+
+
+class Snapshot(namedtuple("Snapshot", "directory files super_tags")):
+    """
+    Excel files found by one scan of a directory.
+    files[tuple]: ScannedFile of each excel file, sorted by path
+    super_tags[tuple]: canonified names of top level directories
+    """
+
+    __slots__ = ()
+
+    def by_rel(self):
+        return {f.rel: f for f in self.files}
+
+    def diff(self, old):
+        """
+        Returns (added, removed, changed) files of this snapshot
+        compared to an older snapshot old.
+        A file changed if its size or mtime changed.
+        """
+        old_files = old.by_rel()
+        new_files = self.by_rel()
+        added = [f for rel, f in new_files.items() if rel not in old_files]
+        removed = [f for rel, f in old_files.items() if rel not in new_files]
+        changed = [
+            f
+            for rel, f in new_files.items()
+            if rel in old_files
+            and (f.size, f.mtime) != (old_files[rel].size, old_files[rel].mtime)
+        ]
+        return (added, removed, changed)
+
+
+class Scanner:
+    """
+    Finds excel files in a directory with os.scandir.
+
+    Tags are built from relative paths while descending,
+    so each directory's tag prefix is made once.
+    Canonified super tags are kept, so scanning again is cheaper.
+    """
+
+    def __init__(self, canonify, ignore=DEFAULT_IGNORE):
+        """
+        canonify[function]: mw.col.tags.canonify
+        ignore[iterable]: glob patterns of file and directory names to skip
+        """
+        self._canonify = canonify
+        self._canon = {}
+        self.ignore = tuple(ignore)
+
+    def super_tag(self, name):
+        try:
+            return self._canon[name]
+        except KeyError:
+            pass
+        # TODO: what will happen if directory contains whitespace?
+        tag = unicodedata.normalize("NFC", name)
+        tag = " ".join(self._canonify([tag])).strip()
+        self._canon[name] = tag
+        return tag
+
+    def ignored(self, name):
+        return any(fnmatch.fnmatch(name, pat) for pat in self.ignore)
+
+    def scan(self, directory):
+        """Returns a Snapshot of the excel files in directory"""
+        files = []
+        super_tags = []
+        self._scan_dir(directory, "", "", 0, files, super_tags)
+        return Snapshot(directory, tuple(files), tuple(super_tags))
+
+    def _scan_dir(self, path, rel, prefix, depth, files, super_tags):
+        """
+        rel[str]: path relative to the synced directory, "" for itself
+        prefix[str]: tag prefix of files in path, e.g. "french::word::"
+        """
+        if depth > MAX_DEPTH:
+            raise LongDirectoryHierarchyError(path)
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+        for entry in entries:
+            name = entry.name
+            if self.ignored(name):
+                continue
+            if entry.is_dir():
+                if depth == 0:
+                    super_tags.append(self.super_tag(name))
+                # directory links are not followed, as with os.walk
+                if not entry.is_symlink():
+                    self._scan_dir(
+                        entry.path,
+                        os.path.join(rel, name),
+                        prefix + name + "::",
+                        depth + 1,
+                        files,
+                        super_tags,
+                    )
+            elif name.endswith(EXCEL_EXTS + TEXT_EXTS):
+                st = entry.stat()
+                # file.name.xlsx becomes tag filename,
+                # and file.part2.xlsx tag file
+                tag = prefix + "".join(shard_base(name.rsplit(".", 1)[0]).split("."))
+                files.append(
+                    ScannedFile(
+                        entry.path,
+                        os.path.join(rel, name),
+                        tag,
+                        st.st_size,
+                        st.st_mtime_ns,
+                    )
+                )
@@ -0,0 +1,214 @@
+import os
+import json
+import hashlib
+
+USER_FILES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "user_files"
+)
+STATE_VERSION = 3
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class RowsHash:
+    """rows_hash of rows, computed while the rows are written"""
+
+    def __init__(self):
+        self.h = hashlib.sha1()
+
+    def update(self, row):
+        self.h.update(json.dumps(row, ensure_ascii=False).encode("utf-8"))
+        self.h.update(b"\n")
+
+    def rows(self, rows):
+        """Yields rows, adding each one to the hash"""
+        for row in rows:
+            self.update(row)
+            yield row
+
+    def hexdigest(self):
+        return self.h.hexdigest()
+
+
+def rows_hash(rows):
+    h = RowsHash()
+    for row in rows:
+        h.update(row)
+    return h.hexdigest()
+
+
+def row_hash(note_data, tag):
+    """Short hash of the raw cells of a note row, and the tag of its file"""
+    data = [note_data["model"], list(note_data["fields"].items()), tag]
+    return hashlib.blake2b(
+        json.dumps(data, ensure_ascii=False).encode("utf-8"), digest_size=8
+    ).hexdigest()
+
+
+def nids_hash(nids):
+    return hashlib.sha1(
+        ",".join(str(nid) for nid in sorted(nids)).encode("ascii")
+    ).hexdigest()
+
+
+class SyncState:
+    """
+    Persistent record of the last sync, stored in the add-on's user_files.
+
+    One state file is kept per (collection, directory) pair.
+    "files" holds one record per workbook, keyed by path relative to directory:
+    {"size": int, "mtime": int, "hash": str,
+     "nids": [int], "clean": bool, "synced": int, "mods": {str: int},
+     "rows": {str: str}}
+    A file is "clean" if every note row in it had a note id after the sync.
+    "synced" is when the sync started reading notes, in seconds. Notes whose
+    mod is not before it may have changed since, and are compared again.
+    "mods" maps note ids to their mod after the sync. Notes with another mod
+    changed since, even if it is older, e.g. when AnkiWeb sync pulled them in.
+    "rows" maps note ids to the row_hash of their rows, for files
+    Excel -> Anki read.
+
+    "exports" holds one record per file written by Anki -> Excel:
+    {"size": int, "mtime": int, "nids": str, "header": str, "rows": str}
+    "nids", "header" and "rows" are hashes of the exported note ids, of the
+    note type rows and column widths, and of all exported rows.
+    """
+
+    def __init__(self, col_path, directory):
+        self.directory = directory
+        key = hashlib.sha1(
+            "\n".join((col_path, directory)).encode("utf-8")
+        ).hexdigest()[:16]
+        self.path = os.path.join(USER_FILES, "sync_state_%s.json" % key)
+        self.data = self.empty()
+
+    def empty(self):
+        return {
+            "version": STATE_VERSION,
+            "super_tags": [],
+            "files": {},
+            "exports": {},
+        }
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+        if not data or data.get("version") != STATE_VERSION:
+            data = self.empty()
+        for key, val in self.empty().items():
+            data.setdefault(key, val)
+        self.data = data
+
+    def save(self):
+        if not os.path.exists(USER_FILES):
+            os.makedirs(USER_FILES)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f)
+        os.replace(tmp, self.path)
+
+    def relpath(self, src):
+        return os.path.relpath(src, self.directory)
+
+    def record(self, src):
+        return self.data["files"].get(self.relpath(src))
+
+    def export_record(self, src):
+        return self.data["exports"].get(self.relpath(src))
+
+    def set_super_tags(self, super_tags):
+        """Drops all file records if the set of super tags changed."""
+        super_tags = sorted(super_tags)
+        if self.data["super_tags"] != super_tags:
+            self.data["files"] = {}
+            self.data["exports"] = {}
+            self.data["super_tags"] = super_tags
+
+    def same_stat(self, src, rec):
+        try:
+            st = os.stat(src)
+        except OSError:
+            return False
+        return st.st_size == rec["size"] and st.st_mtime_ns == rec["mtime"]
+
+    def unchanged(self, src, size, mtime):
+        """
+        True if the file matches its record by size and mtime,
+        or by content hash if only mtime differs.
+        size, mtime[int]: from the scan of the file, mtime in ns
+        """
+        rec = self.record(src)
+        if not rec or not rec["clean"]:
+            return False
+        if size != rec["size"]:
+            return False
+        if mtime == rec["mtime"]:
+            return True
+        if file_hash(src) == rec["hash"]:
+            rec["mtime"] = mtime
+            return True
+        return False
+
+    def update_file(self, src, nids, clean, synced, mods, rows=None):
+        """
+        mods[dict]: {nid: mod} of the notes in nids
+        rows[dict]: {nid: row hash} of the rows of the notes
+        Keys are stored as strings, as json has no other object keys.
+        """
+        st = os.stat(src)
+        self.data["files"][self.relpath(src)] = {
+            "size": st.st_size,
+            "mtime": st.st_mtime_ns,
+            "hash": file_hash(src),
+            "nids": nids,
+            "clean": clean,
+            "synced": synced,
+            "mods": {str(nid): mod for nid, mod in mods.items()},
+            "rows": {str(nid): h for nid, h in (rows or {}).items()},
+        }
+
+    def synced_mods(self, src):
+        """Returns {nid: mod} of the notes of the file after its last sync"""
+        rec = self.record(src)
+        if not rec:
+            return {}
+        return {int(nid): mod for nid, mod in rec["mods"].items()}
+
+    def row_hashes(self, src):
+        """
+        Returns (synced, {nid: row hash}) from the last sync of the file,
+        or (0, {}) if it has no record.
+        """
+        rec = self.record(src)
+        if not rec:
+            return (0, {})
+        rows = rec.get("rows", {})
+        return (rec["synced"], {int(nid): h for nid, h in rows.items()})
+
+    def update_export(self, src, nids, header, rows):
+        st = os.stat(src)
+        self.data["exports"][self.relpath(src)] = {
+            "size": st.st_size,
+            "mtime": st.st_mtime_ns,
+            "nids": nids,
+            "header": header,
+            "rows": rows,
+        }
+
+    def prune(self, srcs):
+        """Drops records of files that are not in srcs."""
+        keep = set(self.relpath(src) for src in srcs)
+        for section in ("files", "exports"):
+            records = self.data[section]
+            for rel in list(records):
+                if rel not in keep:
+                    del records[rel]
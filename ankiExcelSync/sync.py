@@ -1,33 +1,85 @@
 import os
+import time
 import unicodedata
 import urllib.parse
 import re
+import functools
+import threading
+from collections import Counter
 from operator import itemgetter
 
 from anki import version as ankiversion
+from anki.notes import Note
+from anki.utils import ids2str, intTime, joinFields, splitFields
 from aqt import mw
 from aqt.editor import Editor
 from aqt.utils import showText
 
-from .excel import ExcelFile
+try:
+    from anki.collection import AddNoteRequest
+except ImportError:  # before 2.1.55, notes are added one by one
+    AddNoteRequest = None
+
+from .excel import ExcelFile, is_text_file, open_file
 from .errors import *
-from .menu import confirm_win
+from .menu import add_cancel_button, confirm_win
+from .journal import SyncJournal
+from .notes import LOOKUP_CHUNK, NoteRecord, RowDecision
+from .parallel import parse_files, pool_workers, write_files
+from .scanner import DEFAULT_IGNORE, Scanner, shard_base, shard_paths
+from .state import RowsHash, SyncState, nids_hash, row_hash, rows_hash
+from .tags import TagIndex
 from .template import EditorTemplate
+from .timing import SyncStats
+from . import xlsxpatch
 
 ankiver_minor = int(ankiversion.split(".")[2])
 ankiver_major = ankiversion[0:3]
 
+# tag parts that may not be valid in file paths
+SPECIAL_CHARS_RE = re.compile(r"[\s\S]*[<>:\"/|?*\\\\]")
+# number of new notes added to the collection at once
+ADD_BATCH = 500
+# number of distinct cell values kept by prepare_field_val
+FIELD_CACHE_SIZE = 50000
+
 
 class ExcelSync:
-    def __init__(self):
+    def __init__(self, full_rescan=False, dry_run=False, background=True):
+        """
+        full_rescan[bool]: read every excel file, even if it did not change
+        dry_run[bool]: only find what the sync would change, without changing it
+        background[bool]: read and write excel files in Anki's background thread
+        """
         self.log = []
         self.config = mw.addonManager.getConfig(__name__)
+        self.incremental = self.config.get("incremental-sync", True) and not full_rescan
+        self.dry_run = dry_run
+        self.background = background
+        self.continued = False
+        self.editor_templ = None
+        self.journal = None
+        self.stats = None
+        self.scanner = None
+        self.prepare_field_val = functools.lru_cache(maxsize=FIELD_CACHE_SIZE)(
+            self._prepare_field_val
+        )
 
     def show_log(self):
         showText(
             "\n".join(self.log), title="Excel Sync Done", minWidth=450, minHeight=300
         )
 
+    def confirm(self, text):
+        return confirm_win(text, default=0)
+
+    def confirm_sync(self, plan, del_cnt):
+        """
+        plan[tuple]: lines describing what Excel -> Anki will change
+        del_cnt[int]: number of cards or notes it will delete
+        """
+        return self.confirm("\n".join(plan + ("Proceed?",)))
+
     def output_error(self, exception):
         diag, box = showText(
             exception.output_message(),
@@ -41,43 +93,102 @@ class ExcelSync:
         diag.resize(450, 500)
         diag.show()
 
-    def get_super_dirs(self, dirc):
-        super_dirs = []
-        for name in os.listdir(dirc):
-            if os.path.isdir(os.path.join(dirc, name)):
-                name = unicodedata.normalize("NFC", name)
-                # TODO: what will happen if directory contains whitespace?
-                name = " ".join(mw.col.tags.canonify([name])).strip()
-                super_dirs.append(name)
-        return super_dirs
+    def run_stage(self, stage):
+        """
+        Runs stage(), a part of the sync that runs on the main thread.
+        Unless stage continues the sync with in_background, the sync ends
+        after it: the journal is closed, and the log or the error is shown.
+        """
+        self.continued = False
+        success = True
+        try:
+            stage()
+        except SyncCancelledError:
+            self.continued = False
+            self.log.append("Sync cancelled")
+        except AnkiExcelError as e:
+            self.continued = False
+            success = False
+            self.output_error(e)
+        except Exception:
+            self.continued = False
+            success = False
+            raise
+        finally:
+            if not self.continued:
+                self.end_sync(success)
+
+    def use_background(self):
+        # before 2.1.28, the collection can only be used from the main thread
+        return self.background and ankiver_minor >= 28 and hasattr(mw, "taskman")
+
+    def in_background(self, task, on_done):
+        """
+        Runs task() in Anki's background thread, then on_done(result of task)
+        as the next stage on the main thread.
+        Only collection reads and excel files may be used in task.
+        Without a background thread, both run right away.
+        """
+        if not self.use_background():
+            on_done(task())
+            return
+
+        def done(future):
+            self.run_stage(lambda: on_done(future.result()))
+
+        mw.taskman.run_in_background(task, done)
+        self.continued = True
+
+    def end_sync(self, success):
+        if self.journal:
+            self.journal.close()
+        if mw.progress.busy():
+            mw.progress.finish()
+        if self.stats:
+            self.finish_stats()
+        if success:
+            self.show_log()
+
+    def start_progress(self, label, immediate=False):
+        mw.progress.start(immediate=immediate, label=label)
+        add_cancel_button(mw.progress)
+
+    def cancel_requested(self):
+        """True if the Cancel button of the progress window was clicked"""
+        want_cancel = getattr(mw.progress, "want_cancel", None)
+        if want_cancel is not None:
+            return want_cancel()
+        # before want_cancel was added
+        return getattr(getattr(mw.progress, "_win", None), "wantCancel", False)
+
+    def update_progress(self, label, check_cancel=True):
+        """
+        Updates the label of the progress window, from either thread.
+        Raises SyncCancelledError if the sync was cancelled,
+        unless check_cancel is False.
+        """
+        if check_cancel and self.cancel_requested():
+            raise SyncCancelledError()
+        if threading.current_thread() is threading.main_thread():
+            mw.progress.update(label=label)
+        else:
+            mw.taskman.run_on_main(lambda: mw.progress.update(label=label))
 
     def excel_files_in_dir(self, directory):
-        super_tags = self.get_super_dirs(directory)
-
-        file_list = []
-        for root, dirs, files in os.walk(directory):
-            high = root
-            tag = ""
-            fol = None
-            max_loop = 200  # fail-safe that shouldn't run
-            while high != directory and max_loop > 0:
-                high, fol = os.path.split(high)
-                tag = fol + "::" + tag
-                max_loop -= 1
-
-            if max_loop == 0:
-                raise LongDirectoryHierarchyError(root)
-
-            for f in files:
-                if f[-5:] == ".xlsx" or f[-5:] == ".xlsm" or f[-4:] == ".xls":
-                    tf = f.split(".")
-                    tf.pop()
-                    tf = "".join(tf)
-                    tag_name = tag + tf
-                    file_list.append({"src": os.path.join(root, f), "tag": tag_name})
-        return (file_list, super_tags)
-
-    def prepare_field_val(self, txt):
+        """
+        Returns (files, super_tags) of directory, from a Snapshot of it.
+        files[list]: ScannedFile of each excel file
+        """
+        if self.scanner is None:
+            self.scanner = Scanner(
+                mw.col.tags.canonify, self.config.get("ignore-files", DEFAULT_IGNORE)
+            )
+        self.snapshot = self.scanner.scan(directory)
+        return (list(self.snapshot.files), list(self.snapshot.super_tags))
+
+    def _prepare_field_val(self, txt):
+        """Use self.prepare_field_val, which caches results per sync"""
+        start = time.perf_counter()
         # from Editor.onBridgeCmd
         if ankiver_minor <= 19:
             txt = urllib.parse.unquote(txt)
@@ -89,12 +200,27 @@ class ExcelSync:
             txt = txt.replace("\x00", "")
             txt = mw.col.media.escapeImages(txt, unescape=True)
 
-        editor_templ = EditorTemplate()  # esp for editor.mw reference
-        txt = Editor.mungeHTML(editor_templ, txt)
+        if self.editor_templ is None:
+            self.editor_templ = EditorTemplate()  # esp for editor.mw reference
+        txt = Editor.mungeHTML(self.editor_templ, txt)
+        self.stats.add_time("normalise", time.perf_counter() - start)
         return txt
 
+    def finish_stats(self):
+        """Adds timings to the log, and appends them to the trace file"""
+        info = self.prepare_field_val.cache_info()
+        if info.hits or info.misses:
+            self.stats.count("field cache hits", info.hits)
+            self.stats.count("field cache misses", info.misses)
+        self.log.extend(self.stats.summary())
+        if self.config.get("sync-trace", True):
+            try:
+                self.stats.write_trace()
+            except OSError as e:
+                self.log.append("Could not write sync trace: %s" % e)
+
     # Check if note and note_data is the same (fields and tag)
-    def same_note(self, note, note_data, otag, super_tags):
+    def same_note(self, note, note_data, otag):
         fields = note_data["fields"]
         nflds = note.keys()
         for fieldnm in fields:
@@ -108,21 +234,20 @@ class ExcelSync:
                 val = self.prepare_field_val(val)
                 if note[fieldnm] != val:
                     return False
+        tag_index = self.tag_index
+        otag = tag_index.canon(otag)
         for tag in note.tags:
-            tag = unicodedata.normalize("NFC", tag)
-            tag = mw.col.tags.canonify([tag])[0]
-            for super_tag in super_tags:
-                if tag.lower().startswith(super_tag.lower() + "::"):
-                    if tag != otag:
-                        return False
+            tag = tag_index.canon(tag)
+            if tag != otag and tag_index.is_synced(tag):
+                return False
         return True
 
-    def sync_note(self, note, note_data, otag, super_tags):
+    def note_changes(self, note, note_data, otag):
         """
-        note[aqt.notes.Note]: existing note data in Anki
+        note[Note or NoteRecord]: existing note data in Anki
         note_data[dictionary]: note data in Excel.
         otag[string]: note_data["tag"]
-        super_tags[list]: names of top level directories(tags) to sync
+        Returns ({field name: value}, tags) the note should have.
         """
         fields = note_data["fields"]
         nflds = note.keys()
@@ -131,39 +256,114 @@ class ExcelSync:
                 raise FieldNameDoesNotExistError(
                     note_data["path"], note_data["row"], fieldnm, note.model()["name"]
                 )
+        new_fields = {}
         for fieldnm in fields:
             val = fields[fieldnm]
             if val:
-                val = self.prepare_field_val(val)
-                if note[fieldnm] != val:
-                    note[fieldnm] = val
+                new_fields[fieldnm] = self.prepare_field_val(val)
             else:
-                note[fieldnm] = ""
+                new_fields[fieldnm] = ""
 
         # remove target tags and reapply them again
-        for tag in note.tags:
-            for super_tag in super_tags:
-                if tag.lower().startswith(super_tag.lower() + "::"):
-                    note.tags.remove(tag)
-        otag = unicodedata.normalize("NFC", otag)
-        note.tags += mw.col.tags.canonify([otag])
-        note.flush()
-
-    def create_note(self, note_data, tag, decknm):
+        tag_index = self.tag_index
+        tags = [tag for tag in note.tags if not tag_index.is_synced(tag)]
+        otag = tag_index.canon(otag)
+        if otag:
+            tags.append(otag)
+        return (new_fields, tags)
+
+    def apply_changes(self, note, changes):
+        new_fields, tags = changes
+        for fieldnm, val in new_fields.items():
+            if note[fieldnm] != val:
+                note[fieldnm] = val
+        note.tags = tags
+
+    def update_notes(self, modify):
+        """
+        modify[list]: RowDecisions of rows whose notes are modified
+        Applies excel data to all modified notes together.
+        Modified notes are looked up again in chunks,
+        as compare_notes does not keep the notes it compared.
+        """
+        records = self.resolve_notes(decision.nid for decision in modify)
+        changes = []
+        for decision in modify:
+            record = records[decision.nid]
+            note_data = self.note_data(decision)
+            changes.append(
+                (record, self.note_changes(record, note_data, note_data["tag"]))
+            )
+        if not changes:
+            return
+
+        if hasattr(mw.col, "update_notes"):
+            # 2.1.45+: all notes are saved in one backend call.
+            # Notes are loaded from the backend, which col.update_notes needs,
+            # and making a Note from a NoteRecord would take a backend call too
+            notes = []
+            for cnt, (record, change) in enumerate(changes):
+                if cnt % 100 == 0:
+                    self.update_progress(
+                        label="Updating existing notes %d / %d" % (cnt, len(changes))
+                    )
+                note = mw.col.getNote(record.id)
+                self.apply_changes(note, change)
+                notes.append(note)
+            mw.col.update_notes(notes)
+            return
+
+        # Same as Note.flush, but for all notes at once
+        self.update_progress(label="Updating %d existing notes" % len(changes))
+        mod = intTime()
+        usn = mw.col.usn()
+        rows = []
+        tags = set()
+        for record, (new_fields, note_tags) in changes:
+            flds = [
+                new_fields.get(fld["name"], record[fld["name"]])
+                for fld in record.model()["flds"]
+            ]
+            rows.append(
+                (joinFields(flds), mod, usn, mw.col.tags.join(note_tags), record.id)
+            )
+            tags.update(note_tags)
+        nids = [record.id for record, _ in changes]
+        mw.col.db.executemany(
+            "update notes set flds=?, mod=?, usn=?, tags=? where id=?", rows
+        )
+        mw.col.tags.register(list(tags))
+        if hasattr(mw.col, "after_note_updates"):
+            # 2.1.28+: updates the field cache and generates cards
+            mw.col.after_note_updates(nids, mark_modified=False)
+        else:
+            mw.col.updateFieldCache(nids)
+            mw.col.genCards(nids)
+
+    def get_model(self, fpath, model_name):
+        """Returns note type by name, looked up once per sync"""
+        model = self.models_by_name.get(model_name)
+        if model is None:
+            model = mw.col.models.byName(model_name)  # Returns None when not exist
+            if not model:  # check if model doesn't exist
+                raise ModelNameDoesNotExistError(fpath, model_name)
+            model["did"] = self.new_did
+            self.models_by_name[model_name] = model
+        return model
+
+    def create_note(self, note_data, tag):
         """
         note_data: {"row":int, "id":int, "fields":{"fieldName":str_val,}, "model": str_model_name}
+        Returns a new note that is not added to the collection yet,
+        or None if the note cannot be added.
         https://github.com/inevity/addon-movies2anki/blob/master/anki2.1mvaddon/movies2anki/movies2anki.py#L786
         """
         fpath = note_data["path"]
         row = note_data["row"]
         model_name = note_data["model"]
 
-        model = mw.col.models.byName(model_name)  # Returns None when not exist
-        if not model:  # check if model doesn't exist
-            raise ModelNameDoesNotExistError(fpath, model_name)
-
-        mw.col.models.setCurrent(model)
-        note = mw.col.newNote(forDeck=False)
+        model = self.get_model(fpath, model_name)
+        note = Note(mw.col, model)
         # check if fldnm not exist in model
         nflds = note.keys()
         for fldnm in note_data[
@@ -176,12 +376,8 @@ class ExcelSync:
             if not fldval:  # convert NoneType to string
                 fldval = ""
             note[fldnm] = fldval
-        tag = unicodedata.normalize("NFC", tag)
-        note.tags = mw.col.tags.canonify([tag])
-        did = mw.col.decks.byName(decknm)[
-            "id"
-        ]  # decknm is already validated in a2e_sync
-        note.model()["did"] = did
+        tag = self.tag_index.canon(tag)
+        note.tags = [tag] if tag else []
 
         # Check if note is valid, from method aqt.addCards.addNote
         ret = note.dupeOrEmpty()
@@ -190,15 +386,15 @@ class ExcelSync:
                 (
                     "Non-fatal: Note skipped because first field is empty."
                     "Please sync again after fixing this issue.",
-                    "From row: {}, file: {}".join(note_data["row"], note_data["path"]),
+                    "From row: {}, file: {}".format(
+                        note_data["row"], note_data["path"]
+                    ),
                 )
             )
             return None
 
-        if "{{cloze:" in note.model()["tmpls"][0]["qfmt"]:
-            if not mw.col.models._availClozeOrds(
-                note.model(), note.joinedFields(), False
-            ):
+        if "{{cloze:" in model["tmpls"][0]["qfmt"]:
+            if not mw.col.models._availClozeOrds(model, note.joinedFields(), False):
                 self.log.extend(
                     (
                         "Non-fatal: No cloze exist in cloze note type.",
@@ -208,10 +404,35 @@ class ExcelSync:
                         ),
                     )
                 )
+        return note
 
-        cards = mw.col.addNote(note)
-        if not cards:
-
+    def add_notes(self, new_notes):
+        """
+        new_notes[list]: [(note_data, note)] of notes from create_note
+        Adds notes to the collection together, and sets their note_data ids.
+        """
+        if not new_notes:
+            return
+        if AddNoteRequest is not None:
+            mw.col.add_notes(
+                [AddNoteRequest(note, self.new_did) for _, note in new_notes]
+            )
+            with_cards = set(
+                mw.col.db.list(
+                    "select distinct nid from cards where nid in %s"
+                    % ids2str(note.id for _, note in new_notes)
+                )
+            )
+            no_cards = [nd for nd, note in new_notes if note.id not in with_cards]
+        else:
+            no_cards = [nd for nd, note in new_notes if not mw.col.addNote(note)]
+
+        for note_data, note in new_notes:
+            note_data["id"] = note.id
+            note_data["created"] = True
+        if self.journal:
+            self.journal.record_added(note.id for _, note in new_notes)
+        for note_data in no_cards:
             self.log.extend(
                 (
                     "NON-fatal: No cards are made from this note.",
@@ -222,17 +443,248 @@ class ExcelSync:
                 )
             )
 
-        return note.id
+    def resolve_notes(self, note_ids):
+        """
+        note_ids[iterable]: note ids found in excel files
+        Returns {nid: NoteRecord} of the notes that exist in the collection.
+        Notes are fetched from the notes table in chunks instead of one by one.
+        """
+        note_ids = list(set(note_ids))
+        models = {}
+        records = {}
+        for i in range(0, len(note_ids), LOOKUP_CHUNK):
+            chunk = note_ids[i : i + LOOKUP_CHUNK]
+            rows = mw.col.db.all(
+                "select id, mid, mod, flds, tags from notes where id in %s"
+                % ids2str(chunk)
+            )
+            for nid, mid, mod, flds, tags in rows:
+                if mid not in models:
+                    models[mid] = mw.col.models.get(mid)
+                records[nid] = NoteRecord(
+                    nid, models[mid], mod, splitFields(flds), mw.col.tags.split(tags)
+                )
+        return records
+
+    def note_mods(self, note_ids):
+        """Returns {nid: mod} of the notes that exist in the collection."""
+        note_ids = list(set(note_ids))
+        mods = {}
+        for i in range(0, len(note_ids), LOOKUP_CHUNK):
+            chunk = note_ids[i : i + LOOKUP_CHUNK]
+            rows = mw.col.db.all(
+                "select id, mod from notes where id in %s" % ids2str(chunk)
+            )
+            mods.update(rows)
+        return mods
 
-    def get_remove_cards_id(self, super_tags, note_ids):
-        del_ids = []
+    def split_unchanged_files(self, files):
+        """
+        Returns (changed_files, unchanged_files).
+        A file is unchanged if it matches its record in the sync state,
+        and none of its notes were deleted or modified in Anki since it was synced.
+        A note counts as modified if its mod is not the one recorded,
+        or, as mods are in seconds, not before the last sync started reading notes.
+        """
+        if not self.incremental:
+            return (files, [])
+        candidates = [f for f in files if self.state.unchanged(f.src, f.size, f.mtime)]
+        note_ids = []
+        for file in candidates:
+            note_ids.extend(self.state.record(file.src)["nids"])
+        mods = self.note_mods(note_ids)
+
+        unchanged = []
+        for file in candidates:
+            rec = self.state.record(file.src)
+            synced_mods = self.state.synced_mods(file.src)
+            for nid in rec["nids"]:
+                mod = mods.get(nid)
+                if mod is None or mod != synced_mods.get(nid) or mod >= rec["synced"]:
+                    break
+            else:
+                unchanged.append(file)
+        unchanged_src = set(f.src for f in unchanged)
+        changed = [f for f in files if f.src not in unchanged_src]
+        return (changed, unchanged)
+
+    def unchanged_rows(self, file, dt, seen):
+        """
+        Returns ids of notes whose rows in file are the same as in the last sync,
+        and which were not modified in Anki since then,
+        as split_unchanged_files checks for whole files.
+        Notes in more than one row are always compared,
+        except in the first file they are in.
+        """
+        if not self.incremental:
+            return set()
+        nid_cnt = Counter(nd["id"] for nd in dt if nd["id"])
+        synced, hashes = self.state.row_hashes(file.src)
+        synced_mods = self.state.synced_mods(file.src)
+        candidates = [
+            nd["id"]
+            for nd in dt
+            if nd["id"]
+            and nid_cnt[nd["id"]] == 1
+            and nd["id"] not in seen
+            and hashes.get(nd["id"]) == nd["hash"]
+        ]
+        mods = self.note_mods(candidates)
+        return set(
+            nid
+            for nid in candidates
+            if nid in mods and mods[nid] == synced_mods.get(nid) and mods[nid] < synced
+        )
+
+    def save_sync_state(self, files):
+        synced = self.started
+        # mods after the sync, including those of notes it modified or added
+        mods = self.note_mods(nid for _, nids, _, _ in self.files_read for nid in nids)
+        for file, nids, hashes, row_cnt in self.files_read:
+            self.state.update_file(
+                file.src,
+                nids,
+                len(nids) == row_cnt,
+                synced,
+                {nid: mods[nid] for nid in nids if nid in mods},
+                hashes,
+            )
+        self.state.prune([f.src for f in files])
+        self.state.save()
+
+    def export_unchanged(self, path, tag_notes, models, header):
+        """
+        True if the file at path was written by the last Anki -> Excel sync,
+        was not edited since, and the same rows would be written to it again.
+        Rows are always compared, as note mods do not show every change:
+        notes edited in the second of the last export keep the same mod,
+        and notes AnkiWeb sync pulls in keep the older mod of the edit.
+        """
+        if not self.incremental:
+            return False
+        rec = self.state.export_record(path)
+        if not rec or rec["header"] != header:
+            return False
+        if not self.state.same_stat(path, rec):
+            return False
+        if rec["nids"] != nids_hash(note.id for note in tag_notes):
+            return False
+        return rows_hash(ExcelFile(path).rows(tag_notes, models)) == rec["rows"]
+
+    def super_tags_cond(self, super_tags):
+        """
+        Returns (sql, args) matching notes table rows (aliased n)
+        that have one of super_tags, or a child tag of it.
+        """
+        conds = []
+        args = []
         for tag in super_tags:
-            card_ids = mw.col.findCards("tag:" + tag + "::*")
-            card_ids.extend(mw.col.findCards("tag:" + tag))
-            for card_id in card_ids:
-                if mw.col.getCard(card_id).nid not in note_ids:
-                    del_ids.append(card_id)
-        return del_ids
+            tag = tag.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            conds.append("n.tags like ? escape '\\' or n.tags like ? escape '\\'")
+            args.extend(("% {} %".format(tag), "% {}::%".format(tag)))
+        return " or ".join(conds), args
+
+    def get_remove_cards_id(self, super_tags, note_ids):
+        """
+        Returns ids of cards with super tags whose note is not in note_ids.
+        (cid, nid) pairs of all super tags are fetched in a single query.
+        """
+        if not super_tags:
+            return []
+        cond, args = self.super_tags_cond(super_tags)
+        rows = mw.col.db.all(
+            "select c.id, c.nid from cards c join notes n on c.nid = n.id where "
+            + cond,
+            *args
+        )
+        note_ids = set(note_ids)
+        return [cid for cid, nid in rows if nid not in note_ids]
+
+    def get_remove_notes_id(self, super_tags, note_ids):
+        """
+        Returns ids of notes with super tags that are not in note_ids.
+        """
+        if not super_tags:
+            return []
+        cond, args = self.super_tags_cond(super_tags)
+        nids = mw.col.db.list("select n.id from notes n where " + cond, *args)
+        return list(set(nids) - set(note_ids))
+
+    def delete_unit(self):
+        if self.config.get("delete-mode", "cards") == "notes":
+            return "notes"
+        return "cards"
+
+    def get_remove_ids(self, super_tags, note_ids):
+        if self.delete_unit() == "notes":
+            return self.get_remove_notes_id(super_tags, note_ids)
+        return self.get_remove_cards_id(super_tags, note_ids)
+
+    def remove_ids(self, del_ids):
+        if self.delete_unit() == "notes":
+            if self.journal:
+                self.journal.record_delete(del_ids)
+            mw.col.remNotes(del_ids)
+        else:
+            if self.journal:
+                nids = set()
+                for i in range(0, len(del_ids), LOOKUP_CHUNK):
+                    chunk = del_ids[i : i + LOOKUP_CHUNK]
+                    nids.update(
+                        mw.col.db.list(
+                            "select nid from cards where id in %s" % ids2str(chunk)
+                        )
+                    )
+                self.journal.record_delete(nids)
+            mw.col.remCards(del_ids)
+
+    def notes_by_tag(self, super_tags):
+        """
+        Returns {tag: [notes]} of all notes with super tags,
+        grouped by their tag with a super tag.
+        Note ids come from a single query, so each note is loaded once.
+        """
+        notes = {}
+        if not super_tags:
+            return notes
+        tag_index = self.tag_index
+        err_spetags = set()
+        cond, args = self.super_tags_cond(super_tags)
+        nids = mw.col.db.list(
+            "select n.id from notes n where (%s) order by n.id" % cond, *args
+        )
+        for nid in nids:
+            note = mw.col.getNote(nid)
+            note_tag = None
+            for t in note.tags:
+                if tag_index.matches(t):
+                    if note_tag is not None:
+                        raise MultipleSuperTagError(note)
+                    note_tag = t
+            if note_tag is None:
+                continue
+
+            # warn user once when there is a tag with special characters
+            if note_tag not in err_spetags:
+                for t in note_tag.split("::"):
+                    if SPECIAL_CHARS_RE.match(t):
+                        err_spetags.add(note_tag)
+                        self.log.extend(
+                            (
+                                "WARNING: You should avoid use of special characters in tags,",
+                                "as your OS may not support such characters in file path.",
+                                "tag: {}".format(note_tag),
+                            )
+                        )
+                        break
+
+            # tags such as tg::: should become just tg
+            # TODO: the below code does not seem to achieve above comment?
+            # and why above comment in the first place?
+            # filter(None, ...) is shorthand for filter(lambda x: x, ...)
+            note_tag = "::".join(filter(None, note_tag.split("::")))
+            notes.setdefault(note_tag, []).append(note)
+        return notes
 
     def model_data(self):
         models_all = mw.col.models.all()
@@ -256,6 +708,13 @@ class ExcelSync:
         return models
 
     def backup_then_sync(self, syncfunc):
+        # Unloading the collection makes Anki create a backup, but is slow
+        # for large collections. Excel -> Anki syncs can be undone with the
+        # sync journal instead.
+        if not self.config.get("backup-before-sync", False):
+            syncfunc()
+            return
+
         def on_unload():
             mw.loadCollection()
             syncfunc()
@@ -268,311 +727,514 @@ class ExcelSync:
     def a2e_sync(self):
         self.backup_then_sync(self._a2e_sync)
 
+    def read_files(self, files):
+        """
+        Yields (file, note rows) of each file in files, one file at a time,
+        so rows of only one file need to be kept at once.
+        """
+        self.update_progress(label="0 / %d files opened" % len(files))
+        workers = self.config.get("parse-workers", 0)
+        rows = parse_files([f.src for f in files], workers)
+        for cnt, (file, (dt, times)) in enumerate(zip(files, rows), 1):
+            self.update_progress(label="%d / %d files opened" % (cnt, len(files)))
+            self.stats.add_file_times(file.src, times)
+            self.stats.count("files read")
+            self.stats.count("rows", len(dt))
+            yield (file, dt)
+
+    def compare_file(self, index, file, dt, seen):
+        """
+        Compares note rows dt of the index-th file read with the collection.
+        seen[set]: ids of notes in files compared before, which is updated
+        Returns (note ids of existing notes, {nid: row hash} of them,
+        RowDecisions of rows to modify, RowDecisions of rows to add,
+        number of unchanged rows skipped).
+        """
+        for note_data in dt:
+            note_data["hash"] = row_hash(note_data, file.tag)
+
+        # Look up the notes of the file at once,
+        # except those of rows that did not change since last sync
+        with self.stats.phase("lookup"):
+            unchanged_rows = self.unchanged_rows(file, dt, seen)
+            exist_notes = self.resolve_notes(
+                nd["id"] for nd in dt if nd["id"] and nd["id"] not in unchanged_rows
+            )
+
+        # includes field normalisation, which is also timed on its own
+        compare_start = time.perf_counter()
+        exist_note_ids = []
+        hashes = {}
+        modify = []
+        add = []
+        for note_data in dt:
+            note_id = note_data["id"]
+            if note_id in unchanged_rows or note_id in exist_notes:
+                exist_note_ids.append(note_id)
+                hashes[note_id] = note_data["hash"]
+                if note_id not in unchanged_rows and not self.same_note(
+                    exist_notes[note_id], note_data, file.tag
+                ):
+                    modify.append(self.row_decision(index, note_data, note_id))
+            # new note, or note with given id doesn't exist
+            else:
+                add.append(self.row_decision(index, note_data, None))
+        seen.update(exist_note_ids)
+        self.stats.add_time("compare", time.perf_counter() - compare_start)
+        return (exist_note_ids, hashes, modify, add, len(unchanged_rows))
+
+    def row_decision(self, index, note_data, nid):
+        fields = tuple(note_data["fields"].items())
+        return RowDecision(
+            nid, index, note_data["row"], note_data["model"], fields, note_data["hash"]
+        )
+
+    def note_data(self, decision):
+        """Returns the note data of a RowDecision, as parse_file returned it"""
+        file = self.files_read[decision.file][0]
+        return {
+            "row": decision.row,
+            "id": decision.nid,
+            "model": decision.model,
+            "fields": dict(decision.fields),
+            "path": file.src,
+            "tag": file.tag,
+            "file": decision.file,
+            "hash": decision.hash,
+        }
+
     def compare_notes(self, files, super_tags):
-        # Open files and collect all notes
-        dirc = self.dirc
+        """
+        Compares excel files with the collection, one file at a time.
+        Returns (exist_note_ids, modify, add, del_ids), with RowDecisions
+        of the rows to modify and add instead of the rows themselves,
+        so memory use does not grow with the size of all files.
+        """
         exist_note_ids = []
-        modify_notes_data = []
-        add_notes_data = []
-        add_note_cnt = 0
-        cnt = 0
-        for file in files:
-            mw.progress.update(label="%d / %d files opened" % (cnt, len(files)))
-            cnt += 1
-            add_notes_data.append([])
-            tag = file["tag"]
-            ef = ExcelFile(file["src"])
-            ef.load_file()
+        modify = []
+        add = []
+
+        # Skip files that did not change since last sync
+        files, unchanged_files = self.split_unchanged_files(files)
+        for file in unchanged_files:
+            exist_note_ids.extend(self.state.record(file.src)["nids"])
+        if unchanged_files:
+            self.log.append("%d unchanged files skipped" % len(unchanged_files))
+        self.stats.count("files skipped", len(unchanged_files))
+
+        # (file, note ids, {nid: row hash}, number of rows) of each file read,
+        # for the sync state
+        self.files_read = []
+        seen = set()
+        skipped = 0
+        for index, (file, dt) in enumerate(self.read_files(files)):
+            file_nids, hashes, file_modify, file_add, file_skipped = self.compare_file(
+                index, file, dt, seen
+            )
+            self.files_read.append((file, file_nids, hashes, len(dt)))
+            exist_note_ids.extend(file_nids)
+            modify.extend(file_modify)
+            add.extend(file_add)
+            skipped += file_skipped
+        if skipped:
+            self.log.append("%d unchanged rows skipped" % skipped)
+        self.stats.count("rows skipped", skipped)
+
+        self.update_progress(label="Finding %s to delete" % self.delete_unit())
+        with self.stats.phase("lookup"):
+            del_ids = self.get_remove_ids(super_tags, exist_note_ids)
+        return (exist_note_ids, modify, add, del_ids)
+
+    def record_created(self, new_notes, created):
+        """
+        new_notes[list]: [(note_data, note)] of notes add_notes added
+        created[dict]: {file index: [(row, column, note id)]} to write back
+        Adds the new notes to the sync state of their files.
+        """
+        for note_data, note in new_notes:
+            index = note_data["file"]
+            file, nids, hashes, _ = self.files_read[index]
+            nids.append(note.id)
+            hashes[note.id] = note_data["hash"]
+            col = len(note_data["fields"]) + 2
+            created.setdefault(index, []).append((note_data["row"], col, note.id))
+
+    def write_back_ids(self, created):
+        """
+        created[dict]: {file index: [(row, column, note id)]} from record_created
+        Writes note ids of created notes into their excel files.
+        Only files with created notes are opened, once each.
+        With "fast-write-back", only the worksheet xml inside the file is patched.
+        """
+        for cnt, (index, ids) in enumerate(created.items()):
+            # ids are written even if the sync was cancelled
+            self.update_progress(
+                label="Writing note ids %d / %d files" % (cnt, len(created)),
+                check_cancel=False,
+            )
+            path = self.files_read[index][0].src
+            with self.stats.phase("save", path):
+                self.write_ids(path, ids)
+
+    def write_ids(self, path, ids):
+        """ids[list]: [(1 based row, 1 based column, note id)]"""
+        # text files are always rewritten whole, which is fast enough
+        if self.config.get("fast-write-back", True) and not is_text_file(path):
             try:
-                dt = ef.read_file()
-                ef.close()
-            except Exception as e:
-                ef.close()
-                raise
-
-            for note_data in dt:
-                note_data["tag"] = tag
-                if note_data["id"]:
-                    note_id = note_data["id"]
-                    if mw.col.findNotes("nid:%s" % note_id):
-                        note = mw.col.getNote(note_id)
-                        note_data["exist"] = True
-                        exist_note_ids.append(note_id)
-                        if not self.same_note(note, note_data, tag, super_tags):
-                            modify_notes_data.append(note_data)
-
-                    # if note with given id doesn't exist
-                    else:
-                        note_data["exist"] = False
-                        add_note_cnt += 1
-                        add_notes_data[-1].append(note_data)
-                # new note
-                else:
-                    note_data["exist"] = False
-                    add_note_cnt += 1
-                    path = note_data["path"]
-                    add_notes_data[-1].append(note_data)
-
-        mw.progress.update(label="Finding cards to delete")
-        del_ids = self.get_remove_cards_id(super_tags, exist_note_ids)
-        return (
-            exist_note_ids,
-            modify_notes_data,
-            add_note_cnt,
-            add_notes_data,
-            del_ids,
-        )
+                xlsxpatch.write_ids(path, ids)
+                return
+            except xlsxpatch.XlsxPatchError:
+                pass  # save through openpyxl instead
 
-    def _e2a_sync(self):
-        success = True
+        ef = open_file(path)
+        ef.load_file()
         try:
-            mw.progress.start(immediate=True, label="Searching for files")
-            self.log.append("Excel -> Anki")
-
-            # Get value from config
-            dirc = self.config["_directory"]
-            self.dirc = dirc
-            self.log.append("directory: %s" % dirc)
-            decknm = self.config["new-deck"]
-
-            # Check if valid
-            if dirc == "Z:/Somedirectory you want to save excel files":
-                raise DidNotConfigureDirectoryError()
-            if not mw.col.decks.byName(decknm):
-                raise DeckNameDoesNotExistError(decknm)
-
-            # Get all excel file names and supertags
-            files, super_tags = self.excel_files_in_dir(dirc)
+            for row, col, nid in ids:
+                ef.write_cell(row, col, nid)
+            ef.save()
+        finally:
+            ef.close()
 
+    def _e2a_sync(self):
+        self.run_stage(self.e2a_start)
+
+    def e2a_start(self):
+        self.start_progress("Searching for files", immediate=True)
+        self.log.append("Excel -> Anki")
+
+        # Get value from config
+        dirc = self.config["_directory"]
+        self.dirc = dirc
+        self.log.append("directory: %s" % dirc)
+        self.stats = SyncStats("e2a", dirc)
+        decknm = self.config["new-deck"]
+
+        # Check if valid
+        if dirc == "Z:/Somedirectory you want to save excel files":
+            raise DidNotConfigureDirectoryError()
+        deck = mw.col.decks.byName(decknm)
+        if not deck:
+            raise DeckNameDoesNotExistError(decknm)
+        self.new_did = deck["id"]
+        self.models_by_name = {}
+        self.in_background(self.e2a_plan, self.e2a_apply)
+
+    def e2a_plan(self):
+        """
+        Reads excel files and compares them with the collection,
+        without changing anything. Runs in the background thread.
+        """
+        # notes modified from now on are compared again in the next sync,
+        # including those this sync modifies
+        self.started = int(time.time())
+        # Get all excel file names and supertags
+        with self.stats.phase("scan"):
+            files, super_tags = self.excel_files_in_dir(self.dirc)
+        self.tag_index = TagIndex(super_tags, mw.col.tags.canonify)
+        self.state = SyncState(mw.col.path, self.dirc)
+        # full rescans do not use the state, but keep records they do not update
+        self.state.load()
+        self.state.set_super_tags(super_tags)
+        return (files,) + self.compare_notes(files, super_tags)
+
+    def e2a_apply(self, plan):
+        files, exist_note_ids, modify, add, del_ids = plan
+
+        # No need to sync if there are no notes to sync
+        if len(modify) == 0 and len(add) == 0 and len(del_ids) == 0:
+            if not self.dry_run:
+                with self.stats.phase("state"):
+                    self.save_sync_state(files)
+            mw.progress.finish()
+            self.log.append("No note to sync")
+            self.stats.completed = True
+            return
+
+        # Get Confirmation
+        plan = (
+            "{} notes total,".format(len(exist_note_ids)),
+            "{} notes to modify,".format(len(modify)),
+            "{} notes to add,".format(len(add)),
+            "{} {} to delete.".format(len(del_ids), self.delete_unit()),
+        )
+        mw.progress.finish()
+        if self.dry_run:
+            self.log.append("Dry run, nothing was changed")
+            self.log.extend(plan)
+            self.stats.count("notes to modify", len(modify))
+            self.stats.count("notes to add", len(add))
+            self.stats.count("%s to delete" % self.delete_unit(), len(del_ids))
+            self.stats.completed = True
+            return
+        cf = self.confirm_sync(plan, len(del_ids))
+        if not cf:
+            self.log.append("Cancelled e2a sync midway")
+            return
+
+        self.start_progress("Excel -> Anki Sync")
+        if hasattr(mw, "checkpoint"):
+            mw.checkpoint("Excel -> Anki")
+        if self.config.get("sync-journal", True):
+            self.journal = SyncJournal(mw.col)
+        # Update existing notes
+        with self.stats.phase("write"):
+            if self.journal:
+                self.journal.record_modify(decision.nid for decision in modify)
+            self.update_notes(modify)
+        self.stats.count("notes modified", len(modify))
+
+        # Add new notes
+        new_notes = []
+        created = {}
+        add_start = time.perf_counter()
+        try:
+            for cnt, decision in enumerate(add, 1):
+                note_data = self.note_data(decision)
+                note = self.create_note(note_data, note_data["tag"])
+                if note is not None:
+                    new_notes.append((note_data, note))
+                if len(new_notes) >= ADD_BATCH:
+                    self.add_notes(new_notes)
+                    self.record_created(new_notes, created)
+                    new_notes = []
+                    # stops between batches if cancelled
+                    self.update_progress(
+                        label="%d / %d cards updated" % (cnt, len(add))
+                    )
+            self.add_notes(new_notes)
+            self.record_created(new_notes, created)
+        finally:
+            self.stats.add_time("write", time.perf_counter() - add_start)
+            # Write ids of created notes, even if sync stopped midway
+            self.write_back_ids(created)
+            # rows create_note skipped are not counted
+            added = sum(len(ids) for ids in created.values())
+            self.stats.count("notes added", added)
+
+        # Delete cards or notes
+        with self.stats.phase("delete"):
+            self.remove_ids(del_ids)
+        self.stats.count("%s deleted" % self.delete_unit(), len(del_ids))
+        with self.stats.phase("state"):
+            self.save_sync_state(files)
+
+        self.log.extend(
             (
-                exist_note_ids,
-                modify_notes_data,
-                add_note_cnt,
-                add_notes_data,
-                del_ids,
-            ) = self.compare_notes(files, super_tags)
-
-            # No need to sync if there are no notes to sync
-            if len(modify_notes_data) == 0 and add_note_cnt == 0 and len(del_ids) == 0:
-                mw.progress.finish()
-                self.log.append("No note to sync")
-                return
-
-            # Get Confirmation
-            cnfrmtxt = "\n".join(
-                (
-                    "{} notes total,".format(len(exist_note_ids)),
-                    "{} notes to modify,".format(len(modify_notes_data)),
-                    "{} notes to add,".format(add_note_cnt),
-                    "{} cards to delete.".format(len(del_ids)),
-                    "Proceed?",
-                )
+                "{} note exist".format(len(exist_note_ids)),
+                "{} notes modified".format(len(modify)),
+                "{} notes created".format(added),
+                "{} {} deleted".format(len(del_ids), self.delete_unit()),
             )
-            mw.progress.finish()
-            cf = confirm_win(cnfrmtxt, default=0)
-            if not cf:
-                self.log.append("Cancelled e2a sync midway")
-                return
+        )
+        mw.reset()
+        self.stats.completed = True
 
-            mw.progress.start(label="Excel -> Anki Sync")
-            # Update existing notes
-            cnt = 0
-            for note_data in modify_notes_data:
-                if cnt % 100 == 0:
-                    mw.progress.update(
-                        label="Updating existing notes %d / %d"
-                        % (cnt, len(modify_notes_data))
-                    )
-                note_id = note_data["id"]
-                tag = note_data["tag"]
-                note = mw.col.getNote(note_id)
-                self.sync_note(note, note_data, tag, super_tags)
-                cnt += 1
-
-            # Add new notes
-            cnt = 0
-            for note_datas in add_notes_data:
-                if len(note_datas) == 0:
-                    continue
-                ef = ExcelFile(note_datas[0]["path"])
-                ef.load_file()
+    def write_exports(self, to_write, models, col_width):
+        """
+        to_write[list]: [(path, notes)] of excel files to write
+        Writes excel files, and yields (path, notes, rows hash) of each written file.
+        With "write-workers", rows are copied into tuples here,
+        and workbooks are built and saved in worker processes.
+        """
+        workers = pool_workers(self.config.get("write-workers", 0), len(to_write))
+        if not workers:
+            for path, tag_notes in to_write:
+                ef = open_file(path)
+                ef.create_file()
+                # rows are hashed as they are written, instead of built again
+                h = RowsHash()
                 try:
-                    for note_data in note_datas:
-                        if cnt % 100 == 0:
-                            mw.progress.update(
-                                label="%d / %d cards updated" % (cnt, add_note_cnt)
-                            )
-                        tag = note_data["tag"]
-                        note_id = self.create_note(note_data, tag, decknm)
-                        if note_id != None:
-                            ef.set_id(note_data["row"], note_data["fields"], note_id)
-                        cnt += 1
-                    ef.save()
+                    with self.stats.phase("write", path):
+                        ef.write_rows(h.rows(ef.rows(tag_notes, models)), col_width)
+                    with self.stats.phase("save", path):
+                        ef.save()
                 finally:
                     ef.close()
+                yield (path, tag_notes, h.hexdigest())
+            return
+
+        hashes = {}
+
+        def jobs():
+            for path, tag_notes in to_write:
+                rows = [tuple(row) for row in ExcelFile(path).rows(tag_notes, models)]
+                hashes[path] = rows_hash(rows)
+                yield (path, rows)
+
+        notes_by_path = dict(to_write)
+        for path, times in write_files(jobs(), col_width, workers):
+            self.stats.add_file_times(path, times)
+            yield (path, notes_by_path[path], hashes.pop(path))
+
+    def files_to_remove(self, files, exist_file):
+        """Returns excel files in directory that no tag is exported to"""
+        exist_file = set(exist_file)
+        to_remove = []
+        for f in files:
+            if f.src not in exist_file:
+                to_remove.append(f.src)
+        return to_remove
 
-            # Delete cards
-            mw.col.remCards(del_ids)
-
-            self.log.extend(
-                (
-                    "{} note exist".format(len(exist_note_ids)),
-                    "{} notes modified".format(len(modify_notes_data)),
-                    "{} notes created".format(add_note_cnt),
-                    "{} cards deleted".format(len(del_ids)),
-                )
-            )
-            mw.reset()
+    def _a2e_sync(self):
+        self.run_stage(self.a2e_start)
 
-        except AnkiExcelError as e:
-            success = False
-            self.output_error(e)
+    def a2e_start(self):
+        self.start_progress("Looking at directories", immediate=True)
+        self.log.append("Anki -> Excel")
 
-        except Exception as e:
-            success = False
-            raise e
+        # Get value from config
+        dirc = self.config["_directory"]
+        self.dirc = dirc
+        self.log.append("directory: %s" % dirc)
+        self.stats = SyncStats("a2e", dirc)
+        self.in_background(self.a2e_write, self.a2e_finish)
 
-        finally:
-            if mw.progress.busy():
-                mw.progress.finish()
-            if success:
-                self.show_log()
+    def a2e_write(self):
+        """
+        Writes excel files of notes that changed. Runs in the background thread.
+        Returns (files, exist_file) of excel files found and excel files of tags,
+        or None on a dry run.
+        """
+        col_width = self.config["col-width"]
+        dirc = self.dirc
 
-    def _a2e_sync(self):
-        success = True
-        try:
-            mw.progress.start(immediate=True, label="Looking at directories")
-            self.log.append("Anki -> Excel")
+        # Get directories
+        with self.stats.phase("scan"):
+            files, super_tags = self.excel_files_in_dir(dirc)
+        self.state = SyncState(mw.col.path, dirc)
+        self.state.load()
+        self.state.set_super_tags(super_tags)
+        self.tag_index = TagIndex(super_tags, mw.col.tags.canonify)
+        totn = 0
+
+        models = self.model_data()
+
+        # notes modified from now on are compared again in the next sync
+        synced = int(time.time())
+        # Go through notes once, and sort notes per tag
+        self.update_progress(label="Going through all the notes")
+        with self.stats.phase("lookup"):
+            notes = self.notes_by_tag(super_tags)  # notes by tag name
+        self.log.append("total %d tags / files" % len(notes))
+        exist_file = []
+        finf = 0
+        unchanged = 0
+        header = rows_hash(
+            [[m["name"], m["id"]] + m["flds"] for m in models] + [col_width]
+        )
 
-            # Get value from config
-            col_width = self.config["col-width"]
-            dirc = self.config["_directory"]
-            self.dirc = dirc
-            self.log.append("directory: %s" % dirc)
+        # Find excel files to write
+        # tags synced from csv or tsv files are written back to them
+        text_exts = {}
+        for f in files:
+            if is_text_file(f.src):
+                stem, ext = os.path.splitext(f.src)
+                text_exts[shard_base(stem)] = ext
+        # tags with more notes are split into several files
+        max_rows = self.config.get("rows-per-file", 0)
+        to_write = []
+        compare_start = time.perf_counter()
+        for tag in notes:
+            dir_tree = tag.split("::")
+            dir = os.path.join(dirc, *dir_tree)
+            tag_notes = notes[tag]
+            paths = shard_paths(
+                dir, text_exts.get(dir, ".xlsx"), len(tag_notes), max_rows
+            )
+            for n, path in enumerate(paths):
+                exist_file.append(path)
+                shard_notes = tag_notes
+                if len(paths) > 1:
+                    shard_notes = tag_notes[n * max_rows : (n + 1) * max_rows]
+                if self.export_unchanged(path, shard_notes, models, header):
+                    unchanged += 1
+                else:
+                    to_write.append((path, shard_notes))
+            totn += len(tag_notes)
+        self.stats.add_time("compare", time.perf_counter() - compare_start)
 
-            # Get directories
-            files, super_tags = self.excel_files_in_dir(dirc)
-            totn = 0
-            notes = {}  # notes by super tag name
-            nids = []
-            err_spetags = []
-
-            models = self.model_data()
-
-            # Iterate through each tag and sort notes per tag
-            mw.progress.update(label="Going through all the cards")
-
-            for tag in super_tags:
-                card_ids = mw.col.findCards("tag:" + tag + "::*")
-                card_ids.extend(mw.col.findCards("tag:" + tag))
-                for card_id in card_ids:
-                    card = mw.col.getCard(card_id)
-                    note = card.note()
-                    note_tag = None
-                    for t in note.tags:
-                        for tt in super_tags:
-                            if t.startswith(tt + "::") or t == tt:
-                                if note_tag is not None:
-                                    raise MultipleSuperTagError(note)
-                                note_tag = t
-
-                    note_tag = str(note_tag)
-                    note_tag = note_tag.split("::")
-
-                    # warn user once when there is a tag with special characters
-                    if note_tag not in err_spetags:
-                        r = re.compile(r"[\s\S]*[<>:\"/|?*\\\\]")
-                        for t in note_tag:
-                            if r.match(t):
-                                err_spetags.append(note_tag)
-                                self.log.extend(
-                                    (
-                                        "WARNING: You should avoid use of special characters in tags,",
-                                        "as your OS may not support such characters in file path.",
-                                        "tag: {}".format("::".join(note_tag)),
-                                    )
-                                )
-                                break
-
-                    # tags such as tg::: should become just tg
-                    # TODO: the below code does not seem to achieve above comment?
-                    # and why above comment in the first place?
-                    # filter(None, ...) is shorthand for filter(lambda x: x, ...)
-                    note_tag = "::".join(filter(None, note_tag))
-                    if note_tag in notes:
-                        if note.id not in nids:
-                            notes[note_tag].append(note)
-                            nids.append(note.id)
-                    else:
-                        notes[note_tag] = [note]
-                        nids.append(note.id)
-            self.log.append("total %d tags / files" % len(notes))
-            exist_file = []
-            finf = 0
-
-            # Write excel files
-            for tag in notes:
-                mw.progress.update(
-                    label="Writing Spreadsheets %d / %d" % (finf, len(notes))
+        if self.dry_run:
+            to_remove = self.files_to_remove(files, exist_file)
+            self.log.extend(
+                (
+                    "Dry run, nothing was changed",
+                    "total %d notes" % totn,
+                    "%d files to write" % len(to_write),
+                    "%d unchanged files" % unchanged,
+                    "%d files to delete" % len(to_remove),
                 )
-                dir_tree = tag.split("::")
-                dir = os.path.join(dirc, *dir_tree)
-                dir += ".xlsx"
-                exist_file.append(dir)
-                # Write to file
-                ef = ExcelFile(dir)
-                ef.create_file()
-                try:
-                    ef.write(notes[tag], models, col_width)
-                    ef.save()
-                finally:
-                    ef.close()
+            )
+            self.stats.count("notes", totn)
+            self.stats.count("files to write", len(to_write))
+            self.stats.count("files skipped", unchanged)
+            self.stats.count("files to delete", len(to_remove))
+            self.stats.completed = True
+            return None
 
-                # Logging
-                totn += len(notes[tag])
+        # Write excel files
+        try:
+            for dir, tag_notes, tag_rows_hash in self.write_exports(
+                to_write, models, col_width
+            ):
+                tag_nids = [note.id for note in tag_notes]
+                self.state.update_export(
+                    dir, nids_hash(tag_nids), header, tag_rows_hash
+                )
+                # file now matches Anki, Excel -> Anki can skip it
+                self.state.update_file(
+                    dir, tag_nids, True, synced, {n.id: n.mod for n in tag_notes}
+                )
                 finf += 1
-            self.log.append("total %d notes" % totn)
-            mw.progress.update(label="Finding files to delete")
-
-            # Delete excel files if no cards with such tag exist
-            to_remove = []
-            for f in files:
-                f = f["src"]
-                if f not in exist_file:
-                    if f[-5:] == ".xlsx" or f[-5:] == ".xlsm" or f[-4:] == ".xls":
-                        to_remove.append(f)
-
-            if to_remove:
-                mw.progress.finish()
-                cnfrmtxt = "\n".join(
-                    (
-                        "{} excel files to delete.".format(len(to_remove)),
-                        "Proceed with deletion?",
-                    )
+                # stops between files if cancelled
+                self.update_progress(
+                    label="Writing Spreadsheets %d / %d" % (finf, len(to_write))
+                )
+        finally:
+            # keep records of files written before the sync stopped
+            self.state.save()
+        self.stats.count("notes", totn)
+        self.stats.count("files written", finf)
+        self.stats.count("files skipped", unchanged)
+        self.log.append("total %d notes" % totn)
+        if unchanged:
+            self.log.append("%d unchanged files not rewritten" % unchanged)
+        self.update_progress(label="Finding files to delete")
+        return (files, exist_file)
+
+    def a2e_finish(self, written):
+        if written is None:
+            return
+        files, exist_file = written
+
+        # Delete excel files if no cards with such tag exist
+        to_remove = self.files_to_remove(files, exist_file)
+
+        if to_remove:
+            mw.progress.finish()
+            cnfrmtxt = "\n".join(
+                (
+                    "{} excel files to delete.".format(len(to_remove)),
+                    "Proceed with deletion?",
                 )
-                cf = confirm_win(cnfrmtxt, default=0)
-                if cf:
-                    mw.progress.start(label="Deleting redundant files")
+            )
+            cf = self.confirm(cnfrmtxt)
+            if cf:
+                mw.progress.start(label="Deleting redundant files")
+                with self.stats.phase("delete"):
                     for f in to_remove:
                         os.remove(f)
-                        relpath = f.replace(dirc, "")
+                        relpath = f.replace(self.dirc, "")
                         self.log.append("deleted file: %s" % relpath)
-                else:
-                    self.log.append("File(s) not deleted")
-
-            # Finish
-            mw.reset()
-
-        except AnkiExcelError as e:
-            success = False
-            self.output_error(e)
+                self.stats.count("files deleted", len(to_remove))
+            else:
+                self.log.append("File(s) not deleted")
 
-        except Exception as e:
-            success = False
-            raise e
+        with self.stats.phase("state"):
+            self.state.prune(
+                [f for f in exist_file + [f.src for f in files] if os.path.exists(f)]
+            )
+            self.state.save()
 
-        finally:
-            if mw.progress.busy():
-                mw.progress.finish()
-            if success:
-                self.show_log()
+        # Finish
+        mw.reset()
+        self.stats.completed = True
@@ -0,0 +1,40 @@
+import unicodedata
+
+
+class TagIndex:
+    """
+    Tag lookups for one sync.
+
+    Super tags are lower-cased once, so checking whether a tag belongs
+    to a synced super tag is a single set lookup.
+    Canonified tags are cached, as the same tags repeat on many notes.
+    """
+
+    def __init__(self, super_tags, canonify):
+        """
+        super_tags[list]: names of top level directories(tags) to sync
+        canonify[function]: mw.col.tags.canonify
+        """
+        self.super_tags = frozenset(tag.lower() for tag in super_tags)
+        self._canonify = canonify
+        self._canon = {}
+
+    def canon(self, tag):
+        """Returns tag normalized to NFC and canonified"""
+        try:
+            return self._canon[tag]
+        except KeyError:
+            pass
+        tags = self._canonify([unicodedata.normalize("NFC", tag)])
+        canon = tags[0] if tags else ""
+        self._canon[tag] = canon
+        return canon
+
+    def is_synced(self, tag):
+        """True if tag is a child tag of a super tag"""
+        head, sep, _ = tag.partition("::")
+        return bool(sep) and head.lower() in self.super_tags
+
+    def matches(self, tag):
+        """True if tag is a super tag or a child tag of one"""
+        return tag.partition("::")[0].lower() in self.super_tags
@@ -0,0 +1,118 @@
+import os
+import time
+import json
+import contextlib
+
+from .state import USER_FILES
+
+TRACE_FILE = "sync_trace.jsonl"
+# trace is rotated to sync_trace.1.jsonl, sync_trace.2.jsonl, ... above this size
+TRACE_MAX_BYTES = 1 << 20
+TRACE_KEEP = 3
+# number of slowest files listed in the sync log
+SLOW_FILES = 5
+
+
+class SyncStats:
+    """
+    Wall time and counters of one sync run.
+
+    "phases" holds seconds spent in each phase of the sync.
+    Phases timed per file ("load", "parse", "write", "save") are also kept
+    in "files", and are summed over files, which can be more than the
+    wall time of the run when files are handled in worker processes.
+    Files are kept by path relative to directory.
+    """
+
+    def __init__(self, direction, directory):
+        self.direction = direction
+        self.directory = directory
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.counts = {}
+        self.files = {}
+        self.completed = False
+
+    @contextlib.contextmanager
+    def phase(self, name, path=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start, path)
+
+    def add_time(self, name, secs, path=None):
+        self.phases[name] = self.phases.get(name, 0) + secs
+        if path is not None:
+            times = self.files.setdefault(os.path.relpath(path, self.directory), {})
+            times[name] = times.get(name, 0) + secs
+
+    def add_file_times(self, path, times):
+        for name, secs in times.items():
+            self.add_time(name, secs, path)
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def summary(self):
+        """Returns lines for the sync log"""
+        lines = ["", "Time: %.2fs total" % self.elapsed()]
+        for name, secs in self.phases.items():
+            lines.append("  %s: %.2fs" % (name, secs))
+        for name, n in self.counts.items():
+            lines.append("  %s: %d" % (name, n))
+        hits = self.counts.get("field cache hits", 0)
+        misses = self.counts.get("field cache misses", 0)
+        if hits + misses:
+            rate = 100 * hits / (hits + misses)
+            lines.append("  field cache hit rate: %.1f%%" % rate)
+        slow = sorted(
+            self.files.items(), key=lambda item: sum(item[1].values()), reverse=True
+        )[:SLOW_FILES]
+        if len(self.files) > 1:
+            lines.append("Slowest files:")
+            for path, times in slow:
+                lines.append("  %.2fs %s" % (sum(times.values()), path))
+        return lines
+
+    def record(self):
+        return {
+            "time": int(self.started),
+            "direction": self.direction,
+            "completed": self.completed,
+            "total": round(self.elapsed(), 4),
+            "phases": {name: round(secs, 4) for name, secs in self.phases.items()},
+            "counts": self.counts,
+            "files": [
+                dict({"path": path}, **{k: round(v, 4) for k, v in times.items()})
+                for path, times in self.files.items()
+            ],
+        }
+
+    def write_trace(self):
+        """Appends the run to the trace file in user_files, rotating it when large"""
+        path = os.path.join(USER_FILES, TRACE_FILE)
+        if not os.path.exists(USER_FILES):
+            os.makedirs(USER_FILES)
+        if os.path.exists(path) and os.path.getsize(path) > TRACE_MAX_BYTES:
+            rotate(path)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(self.record(), ensure_ascii=False))
+            f.write("\n")
+
+
+def rotated_path(path, n):
+    base, ext = os.path.splitext(path)
+    return "%s.%d%s" % (base, n, ext)
+
+
+def rotate(path):
+    for n in range(TRACE_KEEP - 1, 0, -1):
+        src = rotated_path(path, n)
+        if os.path.exists(src):
+            os.replace(src, rotated_path(path, n + 1))
+    os.replace(path, rotated_path(path, 1))
@@ -0,0 +1,285 @@
+import os
+
+from PyQt5.QtCore import QFileSystemWatcher, QTimer
+from anki.hooks import addHook
+from anki.utils import ids2str
+from aqt import mw
+from aqt.utils import tooltip
+
+from .notes import LOOKUP_CHUNK
+from .scanner import DEFAULT_IGNORE, Scanner, Snapshot
+from .sync import ExcelSync
+
+watcher = None
+
+
+class LiveSync(ExcelSync):
+    """
+    Excel -> Anki sync of the files FolderWatcher saw change.
+
+    Only those files are read. Other files count as they were in the last sync,
+    without looking at their notes in Anki, and only notes that were in the
+    changed files and are not in any file anymore are deleted.
+    It adds and modifies notes without asking, and asks for confirmation
+    only if cards or notes would be deleted.
+    It shows a tooltip instead of the sync log.
+    """
+
+    def __init__(self, folder_watcher, snapshot, changed):
+        """
+        snapshot[Snapshot]: scan of the directory to sync
+        changed[set]: relative paths of files added, changed or removed
+        since the last sync
+        """
+        super().__init__()
+        self.incremental = True
+        self.folder_watcher = folder_watcher
+        self.snapshot = snapshot
+        self.changed = changed
+        # ids of notes that were in changed or removed files in the last sync
+        self.previous_nids = set()
+        # excel files the sync wrote note ids into
+        self.written = set()
+
+    def excel_files_in_dir(self, directory):
+        return (list(self.snapshot.files), list(self.snapshot.super_tags))
+
+    def split_unchanged_files(self, files):
+        changed = []
+        unchanged = []
+        for file in files:
+            if file.rel not in self.changed and self.state.record(file.src):
+                unchanged.append(file)
+            else:
+                changed.append(file)
+        for rel in self.changed:
+            rec = self.state.data["files"].get(rel)
+            if rec:
+                self.previous_nids.update(rec["nids"])
+        return (changed, unchanged)
+
+    def get_remove_ids(self, super_tags, note_ids):
+        """
+        Returns ids of cards or notes with super tags, of notes that were in
+        the changed files and are not in note_ids.
+        """
+        gone = list(self.previous_nids - set(note_ids))
+        if not gone or not super_tags:
+            return []
+        cond, args = self.super_tags_cond(super_tags)
+        if self.delete_unit() == "notes":
+            sql = "select n.id from notes n where n.id in %s and (%s)"
+        else:
+            sql = (
+                "select c.id from cards c join notes n on c.nid = n.id"
+                " where n.id in %s and (%s)"
+            )
+        del_ids = []
+        for i in range(0, len(gone), LOOKUP_CHUNK):
+            chunk = gone[i : i + LOOKUP_CHUNK]
+            del_ids.extend(mw.col.db.list(sql % (ids2str(chunk), cond), *args))
+        return del_ids
+
+    def confirm_sync(self, plan, del_cnt):
+        if del_cnt == 0:
+            return True
+        return super().confirm_sync(plan, del_cnt)
+
+    def write_ids(self, path, ids):
+        super().write_ids(path, ids)
+        self.written.add(path)
+
+    def show_log(self):
+        counts = self.stats.counts if self.stats else {}
+        if "notes added" not in counts:
+            return  # nothing was synced
+        tooltip(
+            "Excel -> Anki: %d notes modified, %d created, %d %s deleted"
+            % (
+                counts["notes modified"],
+                counts["notes added"],
+                counts.get("%s deleted" % self.delete_unit(), 0),
+                self.delete_unit(),
+            )
+        )
+
+    def end_sync(self, success):
+        try:
+            super().end_sync(success)
+        finally:
+            self.folder_watcher.sync_ended(self)
+
+
+class FolderWatcher:
+    """
+    Runs an Excel -> Anki sync of excel files in _directory when they change.
+
+    The directory is scanned every watch-interval seconds. Directories
+    with excel files are also given to QFileSystemWatcher, which uses
+    inotify on Linux and similar notifications on other systems, so
+    saves are noticed without waiting for the next scan.
+    Scans run in Anki's background thread, so large or slow directories,
+    such as network shares, do not freeze Anki.
+    The sync starts once files did not change for watch-interval seconds,
+    so a burst of saves results in one sync.
+    """
+
+    def __init__(self, config):
+        self.directory = config["_directory"]
+        self.interval = int(config.get("watch-interval", 2) * 1000)
+        # the collection is reopened by backup-before-sync
+        self.scanner = Scanner(
+            lambda tags: mw.col.tags.canonify(tags),
+            config.get("ignore-files", DEFAULT_IGNORE),
+        )
+        self.syncing = None
+        # one scan runs in the background at a time
+        self.scanning = False
+        self.stopped = False
+
+        self.fs_watcher = QFileSystemWatcher(mw)
+        self.fs_watcher.directoryChanged.connect(self.on_change)
+        self.fs_watcher.fileChanged.connect(self.on_change)
+        self.poll_timer = QTimer(mw)
+        self.poll_timer.timeout.connect(self.poll)
+        self.quiet_timer = QTimer(mw)
+        self.quiet_timer.setSingleShot(True)
+        self.quiet_timer.setInterval(self.interval)
+        self.quiet_timer.timeout.connect(self.on_quiet)
+
+        # snapshot files were synced at, and latest snapshot
+        self.synced = self.seen = None
+        self.scan(self.on_first_scan)
+
+    def stop(self):
+        self.stopped = True
+        self.poll_timer.stop()
+        self.quiet_timer.stop()
+        paths = self.fs_watcher.directories()
+        if paths:
+            self.fs_watcher.removePaths(paths)
+
+    def scan(self, on_done):
+        """
+        Scans the directory in the background thread,
+        then runs on_done(snapshot) on the main thread.
+        """
+
+        def done(snapshot):
+            self.watch_dirs(snapshot)
+            on_done(snapshot)
+
+        def scanned(future):
+            self.scanning = False
+            if not self.stopped:
+                done(future.result())
+
+        if not hasattr(mw, "taskman"):
+            # Anki versions without a background thread scan on the main thread
+            done(self.scanner.scan(self.directory))
+            return
+        self.scanning = True
+        mw.taskman.run_in_background(lambda: self.scanner.scan(self.directory), scanned)
+
+    def watch_dirs(self, snapshot):
+        dirs = set(os.path.dirname(f.src) for f in snapshot.files)
+        dirs.add(self.directory)
+        watched = set(self.fs_watcher.directories())
+        if dirs - watched:
+            self.fs_watcher.addPaths(list(dirs - watched))
+        if watched - dirs:
+            self.fs_watcher.removePaths(list(watched - dirs))
+
+    def on_first_scan(self, snapshot):
+        self.synced = self.seen = snapshot
+        self.poll_timer.start(self.interval)
+
+    def on_change(self, path):
+        if not self.syncing:
+            self.quiet_timer.start()
+
+    def poll(self):
+        # a scan of a slow directory may take longer than the interval
+        if self.syncing or self.scanning:
+            return
+        self.scan(self.on_poll_scan)
+
+    def on_poll_scan(self, snapshot):
+        if self.syncing:
+            return
+        if snapshot != self.seen:
+            self.seen = snapshot
+            self.quiet_timer.start()
+
+    def on_quiet(self):
+        if self.syncing:
+            return
+        if self.scanning:
+            self.quiet_timer.start()
+            return
+        self.scan(self.on_quiet_scan)
+
+    def on_quiet_scan(self, snapshot):
+        if self.syncing:
+            return
+        if snapshot != self.seen:
+            # still changing
+            self.seen = snapshot
+            self.quiet_timer.start()
+            return
+        changed = set(f.rel for files in snapshot.diff(self.synced) for f in files)
+        if not changed:
+            return
+        if mw.col is None or mw.progress.busy():
+            self.quiet_timer.start()
+            return
+        self.syncing = LiveSync(self, snapshot, changed)
+        self.syncing._e2a_sync()
+
+    def sync_ended(self, sync):
+        """
+        Files changed by the sync itself do not start another sync,
+        files saved while it ran do.
+        If the sync did not complete, because deletions were declined, or it
+        was cancelled or failed, the files it read stay pending, and are synced
+        again on the next change.
+        """
+        self.syncing = None
+        self.scan(lambda now: self.on_sync_scan(sync, now))
+
+    def on_sync_scan(self, sync, now):
+        if not (sync.stats and sync.stats.completed):
+            self.seen = now
+            return
+        current = now.by_rel()
+        files = []
+        for f in self.seen.files:
+            if f.src in sync.written and f.rel in current:
+                f = current[f.rel]
+            files.append(f)
+        self.synced = Snapshot(self.directory, tuple(files), self.seen.super_tags)
+        self.seen = now
+        if any(now.diff(self.synced)):
+            self.quiet_timer.start()
+
+
+def start_watching():
+    global watcher
+    config = mw.addonManager.getConfig(__name__)
+    dirc = config["_directory"]
+    if watcher is None and os.path.isdir(dirc):
+        watcher = FolderWatcher(config)
+
+
+def stop_watching():
+    global watcher
+    if watcher is not None:
+        watcher.stop()
+        watcher = None
+
+
+def setwatch():
+    config = mw.addonManager.getConfig(__name__)
+    if config.get("watch-folder", False):
+        addHook("profileLoaded", start_watching)
+        addHook("unloadProfile", stop_watching)
@@ -0,0 +1,180 @@
+"""
+Writes note ids into an existing .xlsx file without loading it into openpyxl.
+
+Only the xml of the first worksheet is rewritten. All other zip members
+are copied over as they are, without decompressing them.
+"""
+import os
+import re
+import copy
+import shutil
+import struct
+import zipfile
+import posixpath
+from xml.etree import ElementTree
+
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+ROW_RE = re.compile(rb"<row\b[^>]*?(?:/>|>.*?</row>)", re.S)
+CELL_RE = re.compile(rb"<c\b[^>]*?(?:/>|>.*?</c>)", re.S)
+REF_RE = re.compile(rb'\br="([A-Z]+)?(\d+)"')
+STYLE_RE = re.compile(rb'\bs="\d+"')
+DIMENSION_RE = re.compile(rb'<dimension ref="([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?"')
+
+
+class XlsxPatchError(Exception):
+    """The file cannot be patched, and should be saved through openpyxl."""
+
+
+def first_sheet_part(zf):
+    """Returns zip member name of the first worksheet"""
+    try:
+        wb = ElementTree.fromstring(zf.read("xl/workbook.xml"))
+        rels = ElementTree.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    except KeyError as e:
+        raise XlsxPatchError("not an xlsx file") from e
+    sheet = wb.find("{%s}sheets/{%s}sheet" % (NS_MAIN, NS_MAIN))
+    if sheet is None:
+        raise XlsxPatchError("no worksheet")
+    rid = sheet.get("{%s}id" % NS_REL)
+    for rel in rels.iter("{%s}Relationship" % NS_PKG_REL):
+        if rel.get("Id") == rid:
+            target = rel.get("Target")
+            if target.startswith("/"):
+                return target[1:]
+            return posixpath.normpath(posixpath.join("xl", target))
+    raise XlsxPatchError("worksheet relationship not found")
+
+
+def cell_xml(ref, val, old_cell=None):
+    style = b""
+    if old_cell is not None:
+        m = STYLE_RE.search(old_cell[: old_cell.index(b">")])
+        if m:
+            style = b" " + m.group(0)
+    return b'<c r="%s"%s><v>%d</v></c>' % (ref, style, val)
+
+
+def patch_row(row, row_num, cols):
+    """
+    row[bytes]: xml of a <row> element
+    cols[dict]: {1 based column index: int value}
+    """
+    if row.endswith(b"/>"):
+        start = row[:-2].rstrip() + b">"
+        body = b""
+    else:
+        start = row[: row.index(b">") + 1]
+        body = row[len(start) : -len(b"</row>")]
+
+    cells = []
+    for m in CELL_RE.finditer(body):
+        ref = REF_RE.search(m.group(0)[: m.group(0).index(b">")])
+        if not ref or not ref.group(1):
+            raise XlsxPatchError("cell without reference in row %d" % row_num)
+        cells.append((column_index_from_string(ref.group(1).decode()), m.group(0)))
+
+    cells = dict(cells)
+    for col, val in cols.items():
+        ref = ("%s%d" % (get_column_letter(col), row_num)).encode()
+        cells[col] = cell_xml(ref, val, cells.get(col))
+    return start + b"".join(cells[col] for col in sorted(cells)) + b"</row>"
+
+
+def patch_sheet(xml, values):
+    """
+    xml[bytes]: worksheet xml
+    values[dict]: {1 based row: {1 based column: int value}}
+    """
+    out = []
+    pos = 0
+    found = set()
+    max_col = 0
+    for m in ROW_RE.finditer(xml):
+        ref = REF_RE.search(m.group(0)[: m.group(0).index(b">")])
+        if not ref:
+            raise XlsxPatchError("row without reference")
+        row_num = int(ref.group(2))
+        if row_num not in values:
+            continue
+        found.add(row_num)
+        max_col = max(max_col, max(values[row_num]))
+        out.append(xml[pos : m.start()])
+        out.append(patch_row(m.group(0), row_num, values[row_num]))
+        pos = m.end()
+    if len(found) != len(values):
+        raise XlsxPatchError("rows not found: %s" % sorted(set(values) - found))
+    out.append(xml[pos:])
+    xml = b"".join(out)
+
+    # Widen dimension if ids were written outside of it
+    dim = DIMENSION_RE.search(xml)
+    if dim:
+        end_col = dim.group(3) or dim.group(1)
+        end_row = dim.group(4) or dim.group(2)
+        if column_index_from_string(end_col.decode()) < max_col:
+            ref = b'<dimension ref="%s%s:%s%s"' % (
+                dim.group(1),
+                dim.group(2),
+                get_column_letter(max_col).encode(),
+                end_row,
+            )
+            xml = xml[: dim.start()] + ref + xml[dim.end() :]
+    return xml
+
+
+def copy_member(zin, zout, info):
+    """Copies zip member as is, without decompressing it"""
+    zin.fp.seek(info.header_offset)
+    header = zin.fp.read(30)
+    if header[:4] != b"PK\x03\x04":
+        raise XlsxPatchError("bad zip member: %s" % info.filename)
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    zin.fp.seek(info.header_offset + 30 + name_len + extra_len)
+    data = zin.fp.read(info.compress_size)
+
+    zinfo = copy.copy(info)
+    zinfo.flag_bits &= ~0x08  # sizes are written in the header instead
+    zinfo.header_offset = zout.fp.tell()
+    zout.fp.write(zinfo.FileHeader())
+    zout.fp.write(data)
+    zout.start_dir = zout.fp.tell()
+    zout.filelist.append(zinfo)
+    zout.NameToInfo[zinfo.filename] = zinfo
+
+
+def write_ids(path, ids):
+    """
+    Writes note ids into the first worksheet of the .xlsx file at path.
+    ids[list]: [(1 based row, 1 based column, note id)]
+    Raises XlsxPatchError if the file has a layout that cannot be patched.
+    """
+    values = {}
+    for row, col, nid in ids:
+        values.setdefault(row, {})[col] = nid
+
+    tmp = path + ".aes-tmp"
+    try:
+        with zipfile.ZipFile(path) as zin:
+            sheet = first_sheet_part(zin)
+            xml = patch_sheet(zin.read(sheet), values)
+            with zipfile.ZipFile(tmp, "w") as zout:
+                for info in zin.infolist():
+                    if info.filename == sheet:
+                        zinfo = copy.copy(info)
+                        zinfo.compress_type = zipfile.ZIP_DEFLATED
+                        zinfo.flag_bits &= ~0x08
+                        zout.writestr(zinfo, xml)
+                    else:
+                        copy_member(zin, zout, info)
+        shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+    except zipfile.BadZipFile as e:
+        raise XlsxPatchError(str(e)) from e
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
@@ -0,0 +1 @@
+"""Sync benchmarks, run with python -m benchmark"""
@@ -0,0 +1,144 @@
+"""
+Measures sync throughput against a stand-in collection, without Anki.
+
+    python -m benchmark --rows 1000 100000 1000000 --files 10 1000
+
+Each (rows, files) pair runs in its own process:
+Excel -> Anki adding every note, Excel -> Anki again with nothing to change,
+then Anki -> Excel writing every file.
+Rows per second of each sync and peak RSS of the process are reported.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from . import fake_anki, decks
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return rss / (1 << 20)  # bytes
+    return rss / (1 << 10)  # kilobytes
+
+
+def timed_sync(mw, syncfunc):
+    start = time.perf_counter()
+    syncfunc()
+    secs = time.perf_counter() - start
+    if mw.errors:
+        raise RuntimeError(mw.errors[-1])
+    return secs
+
+
+def run(rows, files, config):
+    """Runs the syncs of one (rows, files) pair, returns the results"""
+    mw = fake_anki.install(config)
+    # menu is imported first, as in Anki, since it imports sync
+    from ankiExcelSync import menu, state, timing
+    from ankiExcelSync.sync import ExcelSync
+
+    tmp = tempfile.mkdtemp(prefix="aes-bench-")
+    try:
+        # sync state and trace of benchmark runs are not kept
+        state.USER_FILES = timing.USER_FILES = os.path.join(tmp, "user_files")
+        directory = os.path.join(tmp, "excel")
+        config["_directory"] = directory
+        decks.write_deck_tree(directory, rows, files)
+
+        mw.col = fake_anki.Collection(os.path.join(tmp, "collection.anki2"))
+        mw.col.models.add(decks.MODEL, decks.FIELDS)
+
+        result = {"rows": rows, "files": files}
+        secs = timed_sync(mw, ExcelSync().e2a_sync)
+        added = mw.col.db.scalar("select count() from notes")
+        if added != rows:
+            raise RuntimeError("%d of %d notes added" % (added, rows))
+        result["e2a_add"] = rows / secs
+        secs = timed_sync(mw, ExcelSync().e2a_sync)
+        result["e2a_unchanged"] = rows / secs
+        secs = timed_sync(mw, ExcelSync().a2e_sync)
+        result["a2e"] = rows / secs
+        result["peak_rss_mb"] = peak_rss_mb()
+        mw.col.close()
+        return result
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def load_config(args):
+    with open(os.path.join(ROOT, "config.json"), encoding="utf-8") as f:
+        config = json.load(f)
+    config["incremental-sync"] = args.incremental
+    config["parse-workers"] = args.parse_workers
+    config["write-workers"] = args.write_workers
+    config["sync-trace"] = False
+    return config
+
+
+def format_result(result):
+    rss = result["peak_rss_mb"]
+    return "%9d rows %6d files | e2a add %9.0f/s | e2a unchanged %9.0f/s" % (
+        result["rows"],
+        result["files"],
+        result["e2a_add"],
+        result["e2a_unchanged"],
+    ) + " | a2e %9.0f/s | peak RSS %s" % (
+        result["a2e"],
+        "%.0f MB" % rss if rss is not None else "n/a",
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmark")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--files", type=int, nargs="+", default=[10, 1000])
+    parser.add_argument("--parse-workers", type=int, default=0)
+    parser.add_argument("--write-workers", type=int, default=0)
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="keep incremental-sync on, so unchanged files are skipped",
+    )
+    parser.add_argument("--json", action="store_true", help="print json lines")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        result = run(args.rows[0], args.files[0], load_config(args))
+        print(json.dumps(result))
+        return
+
+    failed = False
+    for rows in args.rows:
+        for files in args.files:
+            if files > rows:
+                continue
+            cmd = [sys.executable, "-m", "benchmark", "--single"]
+            cmd += ["--rows", str(rows), "--files", str(files)]
+            cmd += ["--parse-workers", str(args.parse_workers)]
+            cmd += ["--write-workers", str(args.write_workers)]
+            if args.incremental:
+                cmd.append("--incremental")
+            proc = subprocess.run(cmd, cwd=ROOT, stdout=subprocess.PIPE)
+            if proc.returncode:
+                failed = True
+                continue
+            result = json.loads(proc.stdout.decode().splitlines()[-1])
+            print(json.dumps(result) if args.json else format_result(result))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
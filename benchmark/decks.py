@@ -0,0 +1,56 @@
+"""Synthetic deck trees of excel files, for benchmark runs"""
+import os
+
+MODEL = "Basic"
+FIELDS = ["Front", "Back"]
+# number of top level directories (super tags) files are spread over
+DECKS = 10
+# number of files in one directory
+FILES_PER_DIR = 50
+
+
+def file_paths(directory, files):
+    """
+    Returns paths of excel files, spread over DECKS super tag directories,
+    with at most FILES_PER_DIR files in one directory.
+    e.g. deck3/group0/file13.xlsx, which syncs with tag deck3::group0::file13
+    """
+    paths = []
+    decks = min(files, DECKS)
+    for i in range(files):
+        deck, n = i % decks, i // decks
+        group = n // FILES_PER_DIR
+        paths.append(
+            os.path.join(
+                directory, "deck%d" % deck, "group%d" % group, "file%d.xlsx" % n
+            )
+        )
+    return paths
+
+
+def note_rows(start, count):
+    """Rows of count new notes, the first one being note number start"""
+    for i in range(start, start + count):
+        yield [
+            "B",
+            "front %d" % i,
+            "back %d <b>with</b> some <i>formatting</i>, and a longer text" % i,
+        ]
+
+
+def write_deck_tree(directory, rows, files):
+    """
+    Writes excel files with rows new notes in total, split evenly over files.
+    Returns paths of the written files.
+    """
+    from ankiExcelSync.excel import write_file
+
+    paths = file_paths(directory, files)
+    start = 0
+    for i, path in enumerate(paths):
+        count = rows // files + (1 if i < rows % files else 0)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        header = [[MODEL], ["B"] + FIELDS]
+        write_file(path, header + list(note_rows(start, count)), [])
+        start += count
+    return paths
@@ -0,0 +1,563 @@
+"""
+Stand-in for the parts of Anki that the add-on uses, so syncs can run
+without launching Anki.
+
+The collection keeps notes and cards in a SQLite file, with the columns
+of Anki's notes and cards tables, and behaves like the collection of
+Anki 2.1.26: notes are added one by one, and existing notes are updated
+through the database.
+Background tasks run at once, and Qt timers only fire when they are called.
+"""
+import os
+import re
+import sys
+import time
+import types
+import hashlib
+import sqlite3
+from concurrent.futures import Future
+
+VERSION = "2.1.26"
+
+SCHEMA = """
+create table if not exists notes (
+    id integer primary key, guid text not null, mid integer not null,
+    mod integer not null, usn integer not null, tags text not null,
+    flds text not null, sfld text not null, csum integer not null,
+    flags integer not null, data text not null
+);
+create table if not exists cards (
+    id integer primary key, nid integer not null, did integer not null,
+    ord integer not null, mod integer not null, usn integer not null,
+    type integer not null, queue integer not null, due integer not null,
+    ivl integer not null, factor integer not null, reps integer not null,
+    lapses integer not null, left integer not null, odue integer not null,
+    odid integer not null, flags integer not null, data text not null
+);
+create table if not exists graves (usn integer, oid integer, type integer);
+create index if not exists ix_notes_csum on notes (csum);
+create index if not exists ix_cards_nid on cards (nid);
+"""
+
+HTML_RE = re.compile(r"<[^>]+>")
+
+
+def ids2str(ids):
+    return "(%s)" % ",".join(str(i) for i in ids)
+
+
+def intTime(scale=1):
+    return int(time.time() * scale)
+
+
+def joinFields(flds):
+    return "\x1f".join(flds)
+
+
+def splitFields(flds):
+    return flds.split("\x1f")
+
+
+def fieldChecksum(txt):
+    txt = HTML_RE.sub("", txt)
+    return int(hashlib.sha1(txt.encode("utf-8")).hexdigest()[:8], 16)
+
+
+class DB:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def execute(self, sql, *args):
+        return self.conn.execute(sql, args)
+
+    def executemany(self, sql, rows):
+        self.conn.executemany(sql, rows)
+
+    def all(self, sql, *args):
+        return self.conn.execute(sql, args).fetchall()
+
+    def list(self, sql, *args):
+        return [row[0] for row in self.conn.execute(sql, args)]
+
+    def scalar(self, sql, *args):
+        row = self.conn.execute(sql, args).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+class TagManager:
+    def __init__(self, col):
+        self.col = col
+        self.registry = {}
+
+    def register(self, tags, usn=None):
+        for tag in tags:
+            self.registry.setdefault(tag.lower(), tag)
+
+    def registerNotes(self, nids=None):
+        for tags in self.col.db.list("select tags from notes"):
+            self.register(self.split(tags))
+
+    def canonify(self, tags):
+        out = {}
+        for tag in tags:
+            tag = re.sub(r"[\s\"]", "", tag).strip(":")
+            if tag:
+                tag = self.registry.get(tag.lower(), tag)
+                out[tag.lower()] = tag
+        return sorted(out.values())
+
+    def split(self, tags):
+        return tags.split()
+
+    def join(self, tags):
+        if not tags:
+            return ""
+        return " %s " % " ".join(tags)
+
+
+class ModelManager:
+    def __init__(self, col):
+        self.col = col
+        self.models = {}
+
+    def add(self, name, fields, qfmt=None):
+        mid = len(self.models) + 1
+        self.models[mid] = {
+            "id": mid,
+            "name": name,
+            "type": 0,
+            "sortf": 0,
+            "flds": [{"name": fld, "ord": n} for n, fld in enumerate(fields)],
+            "tmpls": [
+                {"name": "Card 1", "ord": 0, "qfmt": qfmt or "{{%s}}" % fields[0]}
+            ],
+            "did": 1,
+        }
+        return self.models[mid]
+
+    def all(self):
+        return list(self.models.values())
+
+    def get(self, mid):
+        return self.models.get(mid)
+
+    def byName(self, name):
+        for model in self.models.values():
+            if model["name"] == name:
+                return model
+        return None
+
+    def current(self):
+        return self.all()[0]
+
+    def useCount(self, model):
+        return self.col.db.scalar(
+            "select count() from notes where mid = ?", model["id"]
+        )
+
+    def _availClozeOrds(self, model, flds, allowEmpty=True):
+        return [int(n) - 1 for n in re.findall(r"{{c(\d+)::", flds)]
+
+
+class DeckManager:
+    def __init__(self):
+        self.decks = {"Default": {"id": 1, "name": "Default"}}
+
+    def byName(self, name):
+        return self.decks.get(name)
+
+
+class MediaManager:
+    def escapeImages(self, txt, unescape=False):
+        return txt
+
+
+class Note:
+    def __init__(self, col, model=None, id=None):
+        self.col = col
+        if id:
+            self.id = id
+            self.load()
+        else:
+            self.id = None
+            self.guid = None
+            self._model = model
+            self.mid = model["id"]
+            self.tags = []
+            self.fields = [""] * len(model["flds"])
+            self.mod = 0
+            self.usn = 0
+        self._fmap = {fld["name"]: fld["ord"] for fld in self._model["flds"]}
+
+    def load(self):
+        guid, mid, mod, usn, tags, flds = self.col.db.all(
+            "select guid, mid, mod, usn, tags, flds from notes where id = ?", self.id
+        )[0]
+        self.guid = guid
+        self.mid = mid
+        self.mod = mod
+        self.usn = usn
+        self.tags = self.col.tags.split(tags)
+        self.fields = splitFields(flds)
+        self._model = self.col.models.get(mid)
+
+    def model(self):
+        return self._model
+
+    def keys(self):
+        return self._fmap.keys()
+
+    def __getitem__(self, key):
+        return self.fields[self._fmap[key]]
+
+    def __setitem__(self, key, value):
+        self.fields[self._fmap[key]] = value
+
+    def __contains__(self, key):
+        return key in self._fmap
+
+    def joinedFields(self):
+        return joinFields(self.fields)
+
+    def dupeOrEmpty(self):
+        """1 if first field is empty, 2 if it is a duplicate, else False"""
+        val = self.fields[0]
+        if not val.strip():
+            return 1
+        csum = fieldChecksum(val)
+        for flds in self.col.db.list(
+            "select flds from notes where csum = ? and id != ? and mid = ?",
+            csum,
+            self.id or 0,
+            self.mid,
+        ):
+            if splitFields(flds)[0] == val:
+                return 2
+        return False
+
+    def flush(self):
+        self.mod = intTime()
+        self.usn = self.col.usn()
+        sfld = HTML_RE.sub("", self.fields[0])
+        self.col.db.execute(
+            "insert or replace into notes values (?,?,?,?,?,?,?,?,?,?,?)",
+            self.id,
+            self.guid,
+            self.mid,
+            self.mod,
+            self.usn,
+            self.col.tags.join(self.tags),
+            self.joinedFields(),
+            sfld,
+            fieldChecksum(self.fields[0]),
+            0,
+            "",
+        )
+        self.col.tags.register(self.tags)
+
+
+class Collection:
+    def __init__(self, path):
+        self.path = path
+        self.db = DB(path)
+        self.tags = TagManager(self)
+        self.models = ModelManager(self)
+        self.decks = DeckManager()
+        self.media = MediaManager()
+        self._next_id = intTime(1000)
+
+    def usn(self):
+        return -1
+
+    def next_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def newNote(self):
+        return Note(self, self.models.current())
+
+    def getNote(self, nid):
+        return Note(self, id=nid)
+
+    def addNote(self, note):
+        """Adds note with one card per template, returns number of cards"""
+        note.id = self.next_id()
+        note.guid = "%x" % note.id
+        note.flush()
+        return self.genCards([note.id])
+
+    def genCards(self, nids):
+        """Adds the cards missing from notes, returns number of cards added"""
+        cnt = 0
+        have = set(
+            self.db.all("select nid, ord from cards where nid in %s" % ids2str(nids))
+        )
+        for nid, mid in self.db.all(
+            "select id, mid from notes where id in %s" % ids2str(nids)
+        ):
+            did = self.models.get(mid).get("did", 1)
+            for tmpl in self.models.get(mid)["tmpls"]:
+                if (nid, tmpl["ord"]) in have:
+                    continue
+                self.db.execute(
+                    "insert into cards values (?,?,?,?,?,?,0,0,?,0,0,0,0,0,0,0,0,'')",
+                    self.next_id(),
+                    nid,
+                    did,
+                    tmpl["ord"],
+                    intTime(),
+                    self.usn(),
+                    nid,
+                )
+                cnt += 1
+        return cnt
+
+    def updateFieldCache(self, nids):
+        rows = []
+        for nid, flds in self.db.all(
+            "select id, flds from notes where id in %s" % ids2str(nids)
+        ):
+            first = splitFields(flds)[0]
+            rows.append((HTML_RE.sub("", first), fieldChecksum(first), nid))
+        self.db.executemany("update notes set sfld=?, csum=? where id=?", rows)
+
+    def findNotes(self, query):
+        """Supports "" and "tag:name" queries"""
+        if query.startswith("tag:"):
+            tag = query[4:]
+            return self.db.list(
+                "select id from notes where tags like ? or tags like ?",
+                "%% %s %%" % tag,
+                "%% %s::%%" % tag,
+            )
+        return self.db.list("select id from notes")
+
+    def remCards(self, ids, notes=True):
+        nids = self.db.list(
+            "select distinct nid from cards where id in %s" % ids2str(ids)
+        )
+        self.db.execute("delete from cards where id in %s" % ids2str(ids))
+        if notes:
+            orphans = self.db.list(
+                "select id from notes where id in %s and id not in"
+                " (select nid from cards)" % ids2str(nids)
+            )
+            self.remNotes(orphans)
+
+    def remNotes(self, ids):
+        self.db.execute("delete from cards where nid in %s" % ids2str(ids))
+        self.db.execute("delete from notes where id in %s" % ids2str(ids))
+
+    def setMod(self):
+        pass
+
+    def close(self):
+        self.db.close()
+
+
+class Progress:
+    def __init__(self):
+        self._busy = False
+
+    def start(self, *args, **kwargs):
+        self._busy = True
+
+    def update(self, *args, **kwargs):
+        pass
+
+    def finish(self):
+        self._busy = False
+
+    def busy(self):
+        return self._busy
+
+
+class TaskManager:
+    def run_in_background(self, task, on_done=None):
+        future = Future()
+        try:
+            future.set_result(task())
+        except Exception as e:
+            future.set_exception(e)
+        if on_done is not None:
+            on_done(future)
+        return future
+
+    def run_on_main(self, closure):
+        closure()
+
+
+class AddonManager:
+    def __init__(self, config):
+        self.config = config
+
+    def getConfig(self, module):
+        return self.config
+
+    def writeConfig(self, module, config):
+        self.config = config
+
+
+class MainWindow:
+    """mw, with the collection that syncs run against"""
+
+    def __init__(self, config):
+        self.col = None
+        self.progress = Progress()
+        self.taskman = TaskManager()
+        self.addonManager = AddonManager(config)
+        # texts of sync logs and error messages shown to the user
+        self.shown = []
+        self.errors = []
+
+    def reset(self):
+        pass
+
+    def checkpoint(self, name):
+        pass
+
+
+class Editor:
+    def mungeHTML(self, txt):
+        if txt in ("<br>", "<div><br></div>"):
+            return ""
+        return txt
+
+
+class AskUserDialog:
+    """Answers every confirmation with its first button"""
+
+    def __init__(self, text, buttons):
+        self.buttons = buttons
+
+    def setDefault(self, default):
+        pass
+
+    def run(self):
+        return self.buttons[0]
+
+
+class ErrorDialog:
+    def resize(self, *args):
+        pass
+
+    def show(self):
+        pass
+
+
+class Signal:
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def emit(self, *args):
+        for slot in self.slots:
+            slot(*args)
+
+
+class QTimer:
+    """Timer that never fires by itself, emit timeout to fire it"""
+
+    def __init__(self, parent=None):
+        self.timeout = Signal()
+        self.active = False
+
+    def setSingleShot(self, single_shot):
+        pass
+
+    def setInterval(self, msec):
+        pass
+
+    def start(self, msec=None):
+        self.active = True
+
+    def stop(self):
+        self.active = False
+
+    def isActive(self):
+        return self.active
+
+
+class QFileSystemWatcher:
+    def __init__(self, parent=None):
+        self.paths = set()
+        self.directoryChanged = Signal()
+        self.fileChanged = Signal()
+
+    def directories(self):
+        return sorted(self.paths)
+
+    def addPaths(self, paths):
+        self.paths.update(paths)
+
+    def removePaths(self, paths):
+        self.paths.difference_update(paths)
+
+
+def tooltip(msg, *args, **kwargs):
+    sys.modules["aqt"].mw.shown.append(msg)
+
+
+def showText(txt, *args, **kwargs):
+    mw = sys.modules["aqt"].mw
+    if kwargs.get("run") is False:
+        mw.errors.append(txt)
+        return (ErrorDialog(), None)
+    mw.shown.append(txt)
+
+
+def install_modules():
+    """Puts fake anki, aqt and PyQt5 modules into sys.modules"""
+    if "aqt" in sys.modules:
+        return
+    modules = {
+        "anki": {"version": VERSION},
+        "anki.notes": {"Note": Note},
+        "anki.utils": {
+            "ids2str": ids2str,
+            "intTime": intTime,
+            "joinFields": joinFields,
+            "splitFields": splitFields,
+        },
+        "anki.hooks": {"addHook": lambda *args: None},
+        # the add-on skips its menus and hooks while mw is None
+        "aqt": {"mw": None},
+        "aqt.editor": {"Editor": Editor},
+        "aqt.utils": {
+            "showText": showText,
+            "askUserDialog": AskUserDialog,
+            "tooltip": tooltip,
+        },
+        "aqt.main": {"AnkiQt": MainWindow},
+        "PyQt5": {},
+        "PyQt5.QtCore": {"QTimer": QTimer, "QFileSystemWatcher": QFileSystemWatcher},
+        "PyQt5.QtWidgets": {"QAction": object, "QPushButton": object},
+    }
+    for name, attrs in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+
+
+def install(config):
+    """
+    Installs the fake modules and returns the fake mw,
+    which the add-on modules imported after this use.
+    """
+    install_modules()
+    import ankiExcelSync  # noqa: F401
+
+    mw = MainWindow(config)
+    sys.modules["aqt"].mw = mw
+    return mw
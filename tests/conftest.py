@@ -0,0 +1,47 @@
+import os
+import sys
+import json
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmark import decks, fake_anki
+
+with open(os.path.join(ROOT, "config.json"), encoding="utf-8") as f:
+    CONFIG = json.load(f)
+CONFIG["sync-trace"] = False
+
+# syncs run against the fake Anki of the benchmark
+fake_mw = fake_anki.install(dict(CONFIG))
+# menu imports sync, which needs menu to be loaded first
+import ankiExcelSync.menu  # noqa: E402,F401
+import ankiExcelSync.sync  # noqa: E402,F401
+import ankiExcelSync.watch  # noqa: E402,F401
+
+# pytest imports the add-on's __init__.py of the repo root, which sets up
+# menus and hooks unless mw is None. Modules imported above keep fake_mw.
+sys.modules["aqt"].mw = None
+
+
+@pytest.fixture
+def mw(tmp_path, monkeypatch):
+    """fake mw with an empty collection, syncing tmp_path/excel"""
+    from ankiExcelSync import state, timing
+
+    user_files = str(tmp_path / "user_files")
+    monkeypatch.setattr(state, "USER_FILES", user_files)
+    monkeypatch.setattr(timing, "USER_FILES", user_files)
+    monkeypatch.setattr(sys.modules["aqt"], "mw", fake_mw)
+    config = dict(CONFIG)
+    config["_directory"] = str(tmp_path / "excel")
+    fake_mw.addonManager.config = config
+    fake_mw.col = fake_anki.Collection(str(tmp_path / "collection.anki2"))
+    fake_mw.col.models.add(decks.MODEL, decks.FIELDS)
+    del fake_mw.shown[:]
+    del fake_mw.errors[:]
+    yield fake_mw
+    fake_mw.col.close()
+    fake_mw.col = None
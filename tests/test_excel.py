@@ -0,0 +1,81 @@
+import re
+import zipfile
+
+import pytest
+
+from ankiExcelSync.excel import open_file, parse_file, write_file
+
+HEADER = [["Basic"], ["B", "Front", "Back"]]
+
+
+def note_rows(count):
+    return [["B", "front %d" % i, "back %d" % i, 1000 + i] for i in range(count)]
+
+
+def set_dimension(path, ref):
+    """Rewrites the first sheet of path with <dimension ref="ref"/>"""
+    sheet = "xl/worksheets/sheet1.xml"
+    with zipfile.ZipFile(path) as zin:
+        members = [(info, zin.read(info.filename)) for info in zin.infolist()]
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zout:
+        for info, data in members:
+            if info.filename == sheet:
+                xml = re.sub(rb"<dimension [^>]*/>", b"", data)
+                xml = xml.replace(
+                    b"<sheetViews>", b'<dimension ref="%s"/><sheetViews>' % ref
+                )
+                data = xml
+            zout.writestr(info, data)
+
+
+def test_parse_file(tmp_path):
+    path = str(tmp_path / "tag.xlsx")
+    write_file(path, HEADER + note_rows(3), [])
+    rows, times = parse_file(path)
+    assert [(nd["row"], nd["id"]) for nd in rows] == [(3, 1000), (4, 1001), (5, 1002)]
+    assert rows[0]["model"] == "Basic"
+    assert rows[0]["fields"] == {"Front": "front 0", "Back": "back 0"}
+    assert set(times) == {"load", "parse"}
+
+
+def test_parse_file_stale_dimension(tmp_path):
+    # 5 rows and 4 columns, but the sheet claims A1:C3
+    path = str(tmp_path / "tag.xlsx")
+    write_file(path, HEADER + note_rows(3), [])
+    set_dimension(path, b"A1:C3")
+    rows, _ = parse_file(path)
+    assert [(nd["row"], nd["id"]) for nd in rows] == [(3, 1000), (4, 1001), (5, 1002)]
+
+
+@pytest.mark.parametrize("ext", [".csv", ".tsv"])
+def test_text_file_round_trip(tmp_path, ext):
+    path = str(tmp_path / ("tag" + ext))
+    rows = HEADER + [["B", "front, with comma", 'back "quoted"\nlines']]
+    write_file(path, rows, [])
+    with open(path, encoding="utf-8") as f:
+        assert ("\t" in f.read()) == (ext == ".tsv")
+
+    parsed, _ = parse_file(path)
+    assert parsed[0]["id"] is None
+    assert parsed[0]["fields"] == {
+        "Front": "front, with comma",
+        "Back": 'back "quoted"\nlines',
+    }
+
+    tf = open_file(path)
+    tf.load_file()
+    tf.set_id(parsed[0]["row"], ["Front", "Back"], 1000)
+    tf.save()
+    tf.close()
+    parsed, _ = parse_file(path)
+    assert parsed[0]["id"] == 1000
+    assert parsed[0]["fields"]["Back"] == 'back "quoted"\nlines'
+
+
+def test_text_file_temporary_path(tmp_path):
+    # background writes go to a temporary file, with the extension given
+    path = str(tmp_path / "tag.tmp")
+    write_file(path, HEADER + note_rows(2), [], ext=".tsv")
+    with open(path, newline="", encoding="utf-8") as f:
+        assert f.readline() == "Basic\r\n"
+        assert f.readline() == "B\tFront\tBack\r\n"
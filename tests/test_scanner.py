@@ -0,0 +1,59 @@
+import os
+
+from ankiExcelSync.scanner import Scanner, shard_base, shard_paths
+
+
+def canonify(tags):
+    return [tag.replace(" ", "_") for tag in tags]
+
+
+def touch(path, data=b"x"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def test_scan(tmp_path):
+    touch(str(tmp_path / "french" / "words" / "verbs.xlsx"))
+    touch(str(tmp_path / "french" / "verbs.part2.xlsx"))
+    touch(str(tmp_path / "french" / "~$verbs.xlsx"))
+    touch(str(tmp_path / "french" / "notes.txt"))
+    touch(str(tmp_path / "my deck" / "cards.csv"))
+    snapshot = Scanner(canonify).scan(str(tmp_path))
+
+    assert snapshot.super_tags == ("french", "my_deck")
+    assert [(f.rel, f.tag) for f in snapshot.files] == [
+        (os.path.join("french", "verbs.part2.xlsx"), "french::verbs"),
+        (os.path.join("french", "words", "verbs.xlsx"), "french::words::verbs"),
+        (os.path.join("my deck", "cards.csv"), "my deck::cards"),
+    ]
+
+
+def test_diff(tmp_path):
+    scanner = Scanner(canonify)
+    touch(str(tmp_path / "deck" / "a.xlsx"))
+    touch(str(tmp_path / "deck" / "b.xlsx"))
+    touch(str(tmp_path / "deck" / "c.xlsx"))
+    old = scanner.scan(str(tmp_path))
+    assert scanner.scan(str(tmp_path)) == old
+    assert old.diff(old) == ([], [], [])
+
+    touch(str(tmp_path / "deck" / "a.xlsx"), b"longer")
+    os.remove(str(tmp_path / "deck" / "b.xlsx"))
+    touch(str(tmp_path / "deck" / "d.xlsx"))
+    added, removed, changed = scanner.scan(str(tmp_path)).diff(old)
+    assert [f.rel for f in added] == [os.path.join("deck", "d.xlsx")]
+    assert [f.rel for f in removed] == [os.path.join("deck", "b.xlsx")]
+    assert [f.rel for f in changed] == [os.path.join("deck", "a.xlsx")]
+
+
+def test_shard_paths():
+    assert shard_paths("deck/tag", ".xlsx", 10, 0) == ["deck/tag.xlsx"]
+    assert shard_paths("deck/tag", ".xlsx", 10, 10) == ["deck/tag.xlsx"]
+    assert shard_paths("deck/tag", ".csv", 21, 10) == [
+        "deck/tag.part1.csv",
+        "deck/tag.part2.csv",
+        "deck/tag.part3.csv",
+    ]
+    assert shard_base("deck/tag.part12") == "deck/tag"
+    assert shard_base("deck/tag.partial") == "deck/tag.partial"
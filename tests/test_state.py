@@ -0,0 +1,48 @@
+import json
+
+from ankiExcelSync import state
+from ankiExcelSync.state import RowsHash, SyncState, rows_hash
+
+
+def test_save_load(tmp_path, monkeypatch):
+    monkeypatch.setattr(state, "USER_FILES", str(tmp_path / "user_files"))
+    directory = tmp_path / "excel"
+    directory.mkdir()
+    src = directory / "tag.xlsx"
+    src.write_bytes(b"rows")
+
+    st = SyncState("collection.anki2", str(directory))
+    st.set_super_tags(["deck"])
+    st.update_file(str(src), [1, 2], True, 100, {1: 90, 2: 95}, {1: "aa", 2: "bb"})
+    st.save()
+
+    loaded = SyncState("collection.anki2", str(directory))
+    loaded.load()
+    assert loaded.data == st.data
+    assert loaded.synced_mods(str(src)) == {1: 90, 2: 95}
+    assert loaded.row_hashes(str(src)) == (100, {1: "aa", 2: "bb"})
+    stat = src.stat()
+    assert loaded.unchanged(str(src), stat.st_size, stat.st_mtime_ns)
+    # same content, touched by another program
+    assert loaded.unchanged(str(src), stat.st_size, stat.st_mtime_ns + 1)
+
+    # each directory has its own state
+    other = SyncState("collection.anki2", str(tmp_path))
+    other.load()
+    assert other.data == other.empty()
+
+
+def test_load_old_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(state, "USER_FILES", str(tmp_path))
+    st = SyncState("collection.anki2", "excel")
+    with open(st.path, "w", encoding="utf-8") as f:
+        json.dump({"version": state.STATE_VERSION - 1, "files": {"a": {}}}, f)
+    st.load()
+    assert st.data == st.empty()
+
+
+def test_rows_hash_while_writing():
+    rows = [["Basic"], ("B", "Front", "Back"), ["B", "front", "back", 1000]]
+    h = RowsHash()
+    assert list(h.rows(iter(rows))) == rows
+    assert h.hexdigest() == rows_hash(rows)
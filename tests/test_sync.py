@@ -0,0 +1,239 @@
+import os
+import time
+
+from benchmark import decks, fake_anki
+
+from ankiExcelSync import sync
+from ankiExcelSync.excel import parse_file, write_file
+from ankiExcelSync.journal import journals, rollback
+
+
+def write_deck(mw, rows, files=1):
+    return decks.write_deck_tree(mw.addonManager.config["_directory"], rows, files)
+
+
+def note_backs(mw):
+    return sorted(mw.col.db.list("select flds from notes"))
+
+
+def test_e2a_sync_writes_ids(mw):
+    path = write_deck(mw, 5)[0]
+    sync.ExcelSync(background=False)._e2a_sync()
+    ids = [nd["id"] for nd in parse_file(path)[0]]
+    assert None not in ids
+    assert sorted(ids) == sorted(mw.col.db.list("select id from notes"))
+
+
+def later(monkeypatch):
+    """
+    Moves the clock forward, so notes of earlier syncs were not modified
+    in the second the next sync starts.
+    """
+    now = time.time() + 10
+    monkeypatch.setattr(time, "time", lambda: now)
+
+
+def pull_from_ankiweb(mw, nid, back):
+    """Edits a note as AnkiWeb sync does, keeping the older mod of the edit"""
+    flds = mw.col.db.scalar("select flds from notes where id = ?", nid)
+    flds = flds.split("\x1f")[0] + "\x1f" + back
+    mw.col.db.execute(
+        "update notes set flds = ?, mod = mod - 100 where id = ?", flds, nid
+    )
+
+
+def test_e2a_compares_notes_pulled_by_ankiweb(mw, monkeypatch):
+    path = write_deck(mw, 3)[0]
+    sync.ExcelSync(background=False)._e2a_sync()
+    later(monkeypatch)
+    # notes a sync adds are compared again in the next one
+    sync.ExcelSync(background=False)._e2a_sync()
+
+    before = note_backs(mw)
+    pull_from_ankiweb(mw, parse_file(path)[0][0]["id"], "edited on phone")
+    s = sync.ExcelSync(background=False)
+    s._e2a_sync()
+    assert s.stats.counts["files read"] == 1
+    # the row did not change, but its note did
+    assert s.stats.counts["rows skipped"] == 2
+    assert s.stats.counts["notes modified"] == 1
+    assert note_backs(mw) == before
+
+
+def test_e2a_skips_unchanged_rows(mw, monkeypatch):
+    path = write_deck(mw, 3)[0]
+    sync.ExcelSync(background=False)._e2a_sync()
+    later(monkeypatch)
+    sync.ExcelSync(background=False)._e2a_sync()
+
+    rows = [[decks.MODEL], ["B"] + decks.FIELDS]
+    for nd in parse_file(path)[0]:
+        rows.append(["B", nd["fields"]["Front"], nd["fields"]["Back"], nd["id"]])
+    rows[2][2] = "edited in excel"
+    write_file(path, rows, [])
+    s = sync.ExcelSync(background=False)
+    s._e2a_sync()
+    assert s.stats.counts["rows skipped"] == 2
+    assert s.stats.counts["notes modified"] == 1
+    assert "edited in excel" in "".join(note_backs(mw))
+
+    # full rescans compare every row
+    s = sync.ExcelSync(full_rescan=True, background=False)
+    s._e2a_sync()
+    assert s.stats.counts["rows skipped"] == 0
+
+
+def a2e(mw):
+    s = sync.ExcelSync(background=False)
+    s._a2e_sync()
+    return s
+
+
+def test_a2e_rewrites_changed_files(mw):
+    paths = write_deck(mw, 4, 2)
+    sync.ExcelSync(background=False)._e2a_sync()
+    assert a2e(mw).stats.counts["files written"] == 2
+    s = a2e(mw)
+    assert s.stats.counts["files written"] == 0
+    assert s.stats.counts["files skipped"] == 2
+
+    # edited in the second of the last export, so with the same mod
+    nid = parse_file(paths[0])[0][0]["id"]
+    mw.col.db.execute(
+        "update notes set flds = ? where id = ?", "front 0\x1fedited in anki", nid
+    )
+    assert a2e(mw).stats.counts["files written"] == 1
+    assert parse_file(paths[0])[0][0]["fields"]["Back"] == "edited in anki"
+
+    pull_from_ankiweb(mw, parse_file(paths[1])[0][0]["id"], "edited on phone")
+    assert a2e(mw).stats.counts["files written"] == 1
+    assert parse_file(paths[1])[0][0]["fields"]["Back"] == "edited on phone"
+
+    # Excel -> Anki keeps both edits
+    sync.ExcelSync(background=False)._e2a_sync()
+    backs = "".join(note_backs(mw))
+    assert "edited in anki" in backs and "edited on phone" in backs
+
+
+def edit_fronts(path):
+    rows = [[decks.MODEL], ["B"] + decks.FIELDS]
+    for n, nd in enumerate(parse_file(path)[0]):
+        rows.append(["B", "edited %d" % n, nd["fields"]["Back"], nd["id"]])
+    write_file(path, rows, [])
+
+
+def test_e2a_updates_notes_together(mw, monkeypatch):
+    path = write_deck(mw, 3)[0]
+    sync.ExcelSync(background=False)._e2a_sync()
+    nid = parse_file(path)[0][0]["id"]
+    # tags that are not synced are kept
+    mw.col.db.execute("update notes set tags = tags || 'marked ' where id = ?", nid)
+
+    edit_fronts(path)
+
+    def flush(note):
+        raise AssertionError("notes are not saved one by one")
+
+    monkeypatch.setattr(fake_anki.Note, "flush", flush)
+    s = sync.ExcelSync(background=False)
+    s._e2a_sync()
+    assert s.stats.counts["notes modified"] == 3
+    assert sorted(mw.col.db.list("select sfld from notes")) == [
+        "edited 0",
+        "edited 1",
+        "edited 2",
+    ]
+    tags = mw.col.db.scalar("select tags from notes where id = ?", nid)
+    assert sorted(mw.col.tags.split(tags)) == ["deck0::group0::file0", "marked"]
+    assert mw.col.db.scalar("select max(mod) from notes") >= s.started
+
+
+def test_e2a_updates_notes_in_one_backend_call(mw, monkeypatch):
+    path = write_deck(mw, 3)[0]
+    sync.ExcelSync(background=False)._e2a_sync()
+    edit_fronts(path)
+
+    calls = []
+
+    def update_notes(notes):
+        calls.append([note.id for note in notes])
+        for note in notes:
+            note.flush()
+
+    # collections of 2.1.45 and later
+    monkeypatch.setattr(mw.col, "update_notes", update_notes, raising=False)
+    sync.ExcelSync(background=False)._e2a_sync()
+    assert len(calls) == 1
+    assert sorted(calls[0]) == sorted(nd["id"] for nd in parse_file(path)[0])
+    assert sorted(mw.col.db.list("select sfld from notes"))[0] == "edited 0"
+
+
+def test_shards_round_trip(mw):
+    mw.addonManager.config["rows-per-file"] = 2
+    path = write_deck(mw, 5)[0]
+    sync.ExcelSync(background=False)._e2a_sync()
+    tags = sorted(mw.col.db.list("select tags from notes"))
+
+    s = a2e(mw)
+    assert s.stats.counts["files written"] == 3
+    assert s.stats.counts["files deleted"] == 1
+    base = os.path.splitext(path)[0]
+    shards = ["%s.part%d.xlsx" % (base, n) for n in (1, 2, 3)]
+    assert sorted(os.listdir(os.path.dirname(path))) == [
+        os.path.basename(shard) for shard in shards
+    ]
+    assert [len(parse_file(shard)[0]) for shard in shards] == [2, 2, 1]
+
+    # shards are read as files of the same tag
+    s = sync.ExcelSync(full_rescan=True, background=False)
+    s._e2a_sync()
+    assert "No note to sync" in s.log
+    assert sorted(mw.col.db.list("select tags from notes")) == tags
+    assert a2e(mw).stats.counts["files skipped"] == 3
+
+
+def test_full_rescan_keeps_export_records(mw):
+    write_deck(mw, 2)
+    sync.ExcelSync(background=False)._e2a_sync()
+    a2e(mw)
+    sync.ExcelSync(full_rescan=True, background=False)._e2a_sync()
+    assert a2e(mw).stats.counts["files skipped"] == 1
+
+
+def test_rollback(mw):
+    path = write_deck(mw, 3)[0]
+    sync.ExcelSync(background=False)._e2a_sync()
+    before = note_backs(mw)
+
+    rows = [[decks.MODEL], ["B"] + decks.FIELDS]
+    for nd in parse_file(path)[0]:
+        rows.append(["B", nd["fields"]["Front"], "changed", nd["id"]])
+    write_file(path, rows[:-1], [])
+    os.utime(path, (1, 1))
+    sync.ExcelSync(background=False)._e2a_sync()
+    assert note_backs(mw) != before
+    assert mw.col.db.scalar("select count() from notes") == 2
+
+    removed, restored = rollback(mw.col, journals(mw.col)[-1])
+    assert (removed, restored) == (0, 3)
+    assert note_backs(mw) == before
+
+    removed, restored = rollback(mw.col, journals(mw.col)[-1])
+    assert (removed, restored) == (3, 0)
+    assert mw.col.db.scalar("select count() from notes") == 0
+    assert journals(mw.col) == []
+
+
+def test_cancel_mid_add_writes_ids(mw, monkeypatch):
+    monkeypatch.setattr(sync, "ADD_BATCH", 2)
+    path = write_deck(mw, 10)[0]
+    s = sync.ExcelSync(background=False)
+    # cancelled once notes are being changed, after the first batch is added
+    s.cancel_requested = lambda: s.journal is not None
+    s._e2a_sync()
+
+    nids = mw.col.db.list("select id from notes")
+    assert 0 < len(nids) < 10
+    ids = [nd["id"] for nd in parse_file(path)[0]]
+    assert sorted(nid for nid in ids if nid) == sorted(nids)
+    assert s.stats.counts["notes added"] == len(nids)
@@ -0,0 +1,102 @@
+from concurrent.futures import Future
+
+import pytest
+from benchmark import decks, fake_anki
+
+from ankiExcelSync import sync
+from ankiExcelSync.excel import parse_file, write_file
+from ankiExcelSync.watch import FolderWatcher
+
+
+def note_count(mw):
+    return mw.col.db.scalar("select count() from notes")
+
+
+@pytest.fixture
+def watcher(mw):
+    """FolderWatcher of 2 files with 2 notes each, after a full sync"""
+    decks.write_deck_tree(mw.addonManager.config["_directory"], 4, 2)
+    sync.ExcelSync(background=False)._e2a_sync()
+    watcher = FolderWatcher(mw.addonManager.config)
+    yield watcher
+    watcher.stop()
+
+
+def edit_file(path, add=0, remove=0):
+    """Removes the last remove rows of the file at path, and adds add new rows"""
+    rows = [[decks.MODEL], ["B"] + decks.FIELDS]
+    for nd in parse_file(path)[0]:
+        rows.append(["B", nd["fields"]["Front"], nd["fields"]["Back"], nd["id"]])
+    rows = rows[: len(rows) - remove]
+    rows.extend(["B", "new %d" % i, "back"] for i in range(add))
+    write_file(path, rows, [])
+
+
+def saved(watcher):
+    """Runs the live sync of files saved since the last poll"""
+    watcher.poll()
+    assert watcher.quiet_timer.isActive()
+    watcher.quiet_timer.stop()
+    watcher.on_quiet()
+
+
+@pytest.mark.parametrize("delete_mode", ["cards", "notes"])
+def test_live_sync_deletes_notes_of_changed_files(mw, watcher, delete_mode):
+    mw.addonManager.config["delete-mode"] = delete_mode
+    # notes that are in no file, but were not in the changed file either
+    note = mw.col.newNote()
+    note["Front"] = "made in anki"
+    note.tags = ["deck0::extra"]
+    mw.col.addNote(note)
+    path = watcher.synced.files[0].src
+    removed = parse_file(path)[0][-1]["id"]
+
+    edit_file(path, add=1, remove=1)
+    saved(watcher)
+    assert not watcher.syncing
+    assert mw.col.db.scalar("select count() from cards where nid = ?", removed) == 0
+    assert mw.col.db.scalar("select count() from notes where id = ?", note.id) == 1
+    assert note_count(mw) == 5
+    assert "1 created, 1 %s deleted" % delete_mode in mw.shown[-1]
+
+
+def test_declined_live_sync_stays_pending(mw, watcher, monkeypatch):
+    path = watcher.synced.files[0].src
+    edit_file(path, add=1, remove=1)
+    # index of the button confirmations are answered with
+    answer = [1]
+    monkeypatch.setattr(
+        fake_anki.AskUserDialog, "run", lambda self: self.buttons[answer[0]]
+    )
+    saved(watcher)
+    assert note_count(mw) == 4
+    assert any(watcher.seen.diff(watcher.synced))
+
+    # the next change syncs the file again
+    answer[0] = 0
+    edit_file(watcher.synced.files[1].src, add=1)
+    saved(watcher)
+    assert note_count(mw) == 5
+    assert mw.col.db.scalar("select count() from cards") == 5
+    assert not any(watcher.seen.diff(watcher.synced))
+
+
+def test_scans_run_in_background(mw, watcher, monkeypatch):
+    tasks = []
+    monkeypatch.setattr(
+        mw.taskman, "run_in_background", lambda task, done: tasks.append((task, done))
+    )
+    watcher.poll()
+    watcher.poll()
+    assert len(tasks) == 1
+    # waits for the running scan
+    watcher.on_quiet()
+    assert len(tasks) == 1
+    assert watcher.quiet_timer.isActive()
+
+    task, done = tasks.pop()
+    future = Future()
+    future.set_result(task())
+    done(future)
+    assert not watcher.scanning
+    assert watcher.seen == watcher.synced
@@ -0,0 +1,51 @@
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font, PatternFill
+
+from ankiExcelSync.xlsxpatch import XlsxPatchError, write_ids
+
+YELLOW = PatternFill("solid", fgColor="FFFF00")
+
+
+def styled_workbook(path):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["Basic"])
+    ws.append(["B", "Front", "Back"])
+    ws.append(["B", "front 0", "back 0"])
+    ws.append(["B", "front 1", "back 1"])
+    ws["B3"].font = Font(bold=True)
+    ws["D4"].fill = YELLOW  # styled, but empty id cell
+    ws.column_dimensions["B"].width = 40
+    wb.create_sheet("Other")["A1"] = "kept"
+    wb.save(path)
+
+
+def test_write_ids_keeps_styles(tmp_path):
+    path = str(tmp_path / "tag.xlsx")
+    styled_workbook(path)
+    write_ids(path, [(3, 4, 1000), (4, 4, 1001)])
+
+    wb = load_workbook(path)
+    ws = wb.worksheets[0]
+    assert [ws.cell(row=r, column=4).value for r in (3, 4)] == [1000, 1001]
+    assert ws["B3"].value == "front 0"
+    assert ws["B3"].font.b
+    assert ws["D4"].fill.fgColor.rgb == YELLOW.fgColor.rgb
+    assert ws.column_dimensions["B"].width == 40
+    assert wb["Other"]["A1"].value == "kept"
+
+    # dimension was widened, so read-only sheets see the ids
+    wb = load_workbook(path, read_only=True)
+    assert wb.worksheets[0].max_column == 4
+
+
+def test_write_ids_missing_row(tmp_path):
+    path = str(tmp_path / "tag.xlsx")
+    styled_workbook(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    with pytest.raises(XlsxPatchError):
+        write_ids(path, [(10, 4, 1000)])
+    with open(path, "rb") as f:
+        assert f.read() == data